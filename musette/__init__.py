@@ -3,5 +3,18 @@
 __author__ = 'gmflanagan'
 __version__ = (0, 5, 10)
 
-from ._environ import environ, Environment
+import sys
+
+from ._environ import Environment
+
+def __getattr__(name):
+    # `environ` is only created when first used (Python >= 3.7)
+    global environ
+    if name == 'environ':
+        from ._environ import environ
+        return environ
+    raise AttributeError(name)
+
+if sys.version_info < (3, 7):
+    from ._environ import environ
 
@@ -0,0 +1,234 @@
+"""
+Command line tools.
+
+Usage:::
+
+    python -m musette profile -m myproject.settings
+    python -m musette profile -o stacks.txt manage.py check
+    python -m musette resolve --dotenv .env conf.d/ > /tmp/env.sh
+    python -m musette resolve --dotenv .env -- gunicorn app:app
+"""
+from __future__ import print_function
+
+import os
+import re
+import sys
+import argparse
+
+
+def profile(args):
+    from .profiling import run, _format_time
+    if args.module:
+        if args.script:
+            args.args.insert(0, args.script)
+        target = args.module
+    elif args.script:
+        target = args.script
+    else:
+        print('profile: give a script or -m MODULE', file=sys.stderr)
+        return 2
+    profiler, elapsed = run(
+        target, bool(args.module), args.args, not args.no_allocations
+    )
+    print('{0}: {1} total, {2} in musette'.format(
+        target, _format_time(elapsed), _format_time(profiler.total())
+    ))
+    print()
+    profiler.print_report(top=args.top)
+    if args.output:
+        with open(args.output, 'w') as f:
+            profiler.write_collapsed(f)
+    return 0
+
+
+FORMATS = ('export', 'json', 'nul', 'env')
+
+# the names a shell, `env` or docker's --env-file can take
+_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def _shell_quote(value):
+    return "'" + value.replace("'", "'\"'\"'") + "'"
+
+
+def render(values, format='export'):
+    """Return `values` as text in `format`: 'export' lines for a shell to
+    source, a 'json' object, 'nul' terminated KEY=value entries (as from
+    `env -0`), or an 'env' block of KEY=value lines (as for `env` or
+    docker's --env-file).
+
+    A ValueError is raised if, for 'export' or 'env', a key isn't a valid
+    environment variable name, which a shell would reject or, worse, run.
+    """
+    keys = sorted(values)
+    if format == 'json':
+        import json
+        return json.dumps(values, indent=2, sort_keys=True) + '\n'
+    if format in ('export', 'env'):
+        check_names(keys)
+    if format == 'nul':
+        return ''.join('{0}={1}\0'.format(k, values[k]) for k in keys)
+    if format == 'env':
+        for key in keys:
+            if '\n' in values[key]:
+                raise ValueError(
+                    "{0}: a value with a newline can't be written as "
+                    "'env', use 'nul' or 'json'".format(key)
+                )
+        return ''.join('{0}={1}\n'.format(k, values[k]) for k in keys)
+    return ''.join(
+        'export {0}={1}\n'.format(k, _shell_quote(values[k])) for k in keys
+    )
+
+
+def check_names(keys):
+    """Raise a ValueError listing any of `keys` which aren't valid
+    environment variable names.
+    """
+    invalid = [key for key in keys if not _NAME.match(key)]
+    if invalid:
+        raise ValueError(
+            'not valid environment variable names: {0}'.format(
+                ', '.join(repr(key) for key in sorted(invalid))
+            )
+        )
+
+
+def _cache_path(cache_dir, files, format, dotenv, overrides):
+    # keyed on the content of the files, rather than their modification
+    # times, so that it holds across copies (eg. container images)
+    import hashlib
+    from . import __version__
+    digest = hashlib.sha1(repr((
+        __version__, format, dotenv, sorted(overrides.items())
+    )).encode('utf-8'))
+    for path in files:
+        digest.update(os.path.abspath(path).encode('utf-8') + b'\0')
+        with open(path, 'rb') as f:
+            digest.update(hashlib.sha1(f.read()).digest())
+    return os.path.join(cache_dir, digest.hexdigest() + '.' + format)
+
+
+def _save(path, data):
+    # atomically, so that concurrent processes can share the cache; failure
+    # to write is logged, not raised, as the output is still good
+    from .compat import atomic_write
+    try:
+        atomic_write(path, data)
+    except Exception as e:
+        import logging
+        logging.getLogger(__file__).warning("not caching %s: %s", path, e)
+
+
+def resolve(args):
+    from .interpolation import expand_files, resolve_files
+    overrides = {}
+    for item in args.set:
+        key, sep, value = item.partition('=')
+        if not sep:
+            print('resolve: --set takes KEY=VALUE, not {0}'.format(item),
+                file=sys.stderr)
+            return 2
+        overrides[key] = value
+    # the environment of a command is read back from json
+    format = 'json' if args.command_ else args.format
+    try:
+        files = expand_files(args.files)
+        path = None
+        data = None
+        if args.cache_dir:
+            path = _cache_path(args.cache_dir, files, format, args.dotenv, overrides)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except (IOError, OSError):
+                pass
+        if data is None:
+            iterator = None
+            if args.dotenv:
+                from .dotenv import iter_dotenv
+                iterator = iter_dotenv
+            values = resolve_files(files, overrides=overrides, iterator=iterator)
+            if args.command_:
+                check_names(values)
+            data = render(values, format).encode('utf-8')
+            if path is not None:
+                _save(path, data)
+    except (IOError, OSError, KeyError, ValueError) as e:
+        if isinstance(e, KeyError) and e.args:
+            # eg. a MissingReferenceError, which str() would quote
+            e = 'missing: {0}'.format(e.args[0])
+        print('resolve: {0}'.format(e), file=sys.stderr)
+        return 1
+    if args.command_:
+        import json
+        environ = dict(os.environ)
+        environ.update(json.loads(data.decode('utf-8')))
+        command = args.command_
+        os.execvpe(command[0], command, environ)
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    stdout.write(data)
+    stdout.flush()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m musette')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+
+    parser_ = commands.add_parser(
+        'profile', help='profile the configuration loading of a module or script',
+        description='Import a settings module, or run a script, with every '
+        'Environment instrumented, and print the time and allocations of '
+        'each operation and the slowest keys.',
+    )
+    parser_.add_argument('-m', dest='module', help='import this module')
+    parser_.add_argument('-o', '--output',
+        help='write the stacks of operations to this file, in the collapsed '
+        'format of flamegraph.pl')
+    parser_.add_argument('--top', type=int, default=10,
+        help='the number of slowest keys to list (default 10)')
+    parser_.add_argument('--no-allocations', action='store_true',
+        help="don't trace allocations, which slows everything down")
+    parser_.add_argument('script', nargs='?', help='run this script')
+    parser_.add_argument('args', nargs=argparse.REMAINDER,
+        help='the arguments of the script')
+    parser_.set_defaults(func=profile)
+
+    parser_ = commands.add_parser(
+        'resolve', help='resolve property or .env files for a shell or command',
+        description='Merge and interpolate property or .env files as '
+        'resolve_files and read_env do, and write the result, or run a '
+        'command (given after --) with it added to the environment.',
+    )
+    parser_.add_argument('files', nargs='+', metavar='file',
+        help='a file, directory or glob pattern; later files take precedence')
+    parser_.add_argument('-f', '--format', choices=FORMATS, default='export',
+        help='export lines (the default), json, nul terminated KEY=value '
+        'entries or an env block of KEY=value lines')
+    parser_.add_argument('--dotenv', action='store_true',
+        help='read the files as .env files, as read_env does')
+    parser_.add_argument('-s', '--set', action='append', default=[],
+        metavar='KEY=VALUE', help='override a value (after interpolation)')
+    parser_.add_argument('--cache-dir', default=os.environ.get('MUSETTE_CACHE_DIR'),
+        help='cache the output here, keyed on the content of the files '
+        '(default: $MUSETTE_CACHE_DIR)')
+    parser_.set_defaults(func=resolve, command_=None)
+
+    argv = sys.argv[1:] if argv is None else list(argv)
+    command = None
+    if argv[:1] == ['resolve'] and '--' in argv:
+        # the command to run
+        i = argv.index('--')
+        argv, command = argv[:i], argv[i + 1:]
+    args = parser.parse_args(argv)
+    if command:
+        args.command_ = command
+    if getattr(args, 'func', None) is None:
+        parser.print_help()
+        return 2
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
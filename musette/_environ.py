@@ -5,20 +5,19 @@ from __future__ import unicode_literals
 import os
 import sys
 import re
-import json
-import warnings
-import glob
-import collections
-import logging
 
-logger = logging.getLogger(__file__)
-
-try:
-    import urllib.parse as urlparse
-except ImportError:
-    # Python <= 2.6
-    import urlparse
+# logging is imported once something else has imported it, as until then
+# nothing can have been configured to handle the (debug) messages
+_logger = None
 
+def _debug(msg, *args):
+    global _logger
+    if _logger is None:
+        if 'logging' not in sys.modules:
+            return
+        import logging
+        _logger = logging.getLogger(__file__)
+    _logger.debug(msg, *args)
 
 if sys.version < '3':
     text_type = unicode
@@ -27,24 +26,255 @@ else:
     basestring = str
 
 from .interpolation import (
-    resolve, resolve_files, StringTemplate, is_variable, interpolated
+    resolve, resolve_files, StringTemplate, is_variable, interpolated,
+    DependencyGraph,
 )
+from .compat import MutableMapping, OrderedDict
 
 __author__ = 'joke2k'
 
 
+_FLOAT_JUNK = re.compile(r'[^\d,\.]')
+_FLOAT_SEPARATOR = re.compile(r'[,\.]')
+
 # return int if possible
 _cast_int = lambda v: int(v) if isinstance(v, basestring) and v.isdigit() else v
 # return str if possibile
 _cast_str = lambda v: str(v) if isinstance(v, basestring) else v
 
 
+_urlparse_module = None
+
+def _urlparse():
+    # urllib.parse, imported with the URL schemes of `Environment` registered
+    # on first use rather than when this module is imported
+    global _urlparse_module
+    if _urlparse_module is None:
+        try:
+            import urllib.parse as module
+        except ImportError:
+            # Python 2
+            import urlparse as module
+        for schtype in ['DB', 'CACHE', 'SEARCH', 'EMAIL']:
+            for scheme in getattr(Environment, schtype + '_SCHEMES'):
+                _register_scheme(module, scheme)
+        _urlparse_module = module
+    return _urlparse_module
+
+def _register_scheme(module, scheme):
+    for method in filter(lambda s: s.startswith('uses_'), dir(module)):
+        getattr(module, method).append(scheme)
+
+def register_scheme(scheme):
+    _register_scheme(_urlparse(), scheme)
+
+
+class _UrlClass(object):
+    # `Environment.URL_CLASS`, which is looked up when first used
+    def __get__(self, obj, cls):
+        return _urlparse().ParseResult
+
+
+class _NoLock(object):
+    # the lock of an environment which isn't thread-safe
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+_NOLOCK = _NoLock()
+
+
+def _source_key(files, defaults, overrides, iterator):
+    # reads of the same files with the same arguments are one source
+    return (
+        tuple(files), tuple(sorted((defaults or {}).items())),
+        tuple(sorted((overrides or {}).items())), iterator,
+    )
+
+
+class _Snapshot(object):
+    # the resolved values of a thread-safe environment, which are never
+    # modified once published; `errors` are the keys which can't be resolved
+    # (whose raw values are given) and `cache` holds the `get_value` results
+    __slots__ = ('values', 'errors', 'cache')
+
+    def __init__(self, values, errors, cache):
+        self.values = values
+        self.errors = errors
+        self.cache = cache
+
+
 class NoValue(object):
     def __repr__(self):
         return '<{0}>'.format(self.__class__.__name__)
 
 
-class Environment(collections.MutableMapping):
+class SettingsError(KeyError, ValueError):
+    """Raised by `Environment.extract` with every variable which is missing
+    (and has no default) or whose value is invalid.
+
+    `missing` is a list of names and `invalid` a dictionary of names to the
+    exception raised when the value was interpolated or cast.
+    """
+
+    def __init__(self, missing=(), invalid=None):
+        self.missing = list(missing)
+        self.invalid = dict(invalid or {})
+        super(SettingsError, self).__init__(self.missing, self.invalid)
+
+    def __str__(self):
+        problems = ['missing: {0}'.format(name) for name in self.missing]
+        problems.extend(
+            'invalid: {0} ({1})'.format(name, self.invalid[name])
+            for name in sorted(self.invalid)
+        )
+        return '; '.join(problems)
+
+
+class FrozenSettings(object):
+    """Base class for the immutable settings objects returned by
+    `Environment.freeze`. Subclasses are generated with one slot per setting.
+    """
+    __slots__ = ()
+
+    def __setattr__(self, key, val):
+        self.__delattr__(key)
+
+    def __delattr__(self, key):
+        raise AttributeError(
+            "'{0}' object is read-only".format(self.__class__.__name__)
+        )
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __repr__(self):
+        return '<{0}: {1}>'.format(
+            self.__class__.__name__, ', '.join(self.__slots__)
+        )
+
+    def _asdict(self):
+        return dict((key, getattr(self, key)) for key in self.__slots__)
+
+    def __reduce__(self):
+        # the class is generated, so is looked up again by `frozen_settings`
+        return frozen_settings, (self._asdict(), self.__class__.__name__)
+
+
+_FROZEN_CLASSES = {}
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+def frozen_settings(values, name='Settings'):
+    """Return a `FrozenSettings` instance with the given attribute values.
+
+    The class is generated with `__slots__` for the keys of `values` (and
+    reused for the same keys), so attribute access is a plain slot read. A
+    ValueError is raised if any key isn't a valid attribute name.
+    """
+    keys = tuple(sorted(values))
+    try:
+        cls = _FROZEN_CLASSES[name, keys]
+    except KeyError:
+        import keyword
+        invalid = [
+            key for key in keys
+            if not _IDENTIFIER.match(key) or keyword.iskeyword(key)
+        ]
+        if invalid:
+            raise ValueError(
+                'not valid attribute names: {0}'.format(
+                    ', '.join(repr(str(key)) for key in invalid)
+                )
+            )
+        cls = _FROZEN_CLASSES[name, keys] = type(
+            str(name), (FrozenSettings,), {'__slots__': keys}
+        )
+    obj = object.__new__(cls)
+    for key in keys:
+        object.__setattr__(obj, key, values[key])
+    return obj
+
+
+class LRUCache(object):
+    """A mapping of at most `maxsize` items, which discards the least
+    recently used item when full, and counts hits and misses.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        data = self._data
+        try:
+            # move to the end, ie. most recently used
+            value = data[key] = data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        data = self._data
+        data[key] = value
+        while len(data) > self.maxsize:
+            try:
+                data.popitem(last=False)
+            except KeyError:
+                # emptied by another thread
+                break
+
+    def clear(self):
+        self._data.clear()
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def info(self):
+        return dict(
+            hits=self.hits, misses=self.misses, maxsize=self.maxsize,
+            currsize=len(self._data),
+        )
+
+
+def _copy_config(value):
+    # a copy of a parsed config, with its own nested dicts and lists
+    if isinstance(value, dict):
+        return dict((k, _copy_config(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [_copy_config(v) for v in value]
+    return value
+
+def _memoized_config(method):
+    # cache the configs parsed from URLs in `URL_CONFIG_CACHE`, returning
+    # copies which callers (eg. Django, which fills in defaults) may modify
+    def wrapper(self, url, *args, **kwargs):
+        cache = self.URL_CONFIG_CACHE
+        if cache is None:
+            return method(self, url, *args, **kwargs)
+        key = (self.__class__, method.__name__, url, args,
+               tuple(sorted(kwargs.items())))
+        try:
+            config = cache.get(key)
+        except TypeError:
+            # unhashable
+            return method(self, url, *args, **kwargs)
+        if config is None:
+            config = method(self, url, *args, **kwargs)
+            cache.put(key, config)
+        return _copy_config(config)
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    wrapper.__wrapped__ = method
+    return wrapper
+
+
+class Environment(MutableMapping):
     """Provide schema-based lookups of environment variables so that each
     caller doesn't have to pass in `cast` and `default` parameters.
 
@@ -56,8 +286,16 @@ class Environment(collections.MutableMapping):
     """
 
     NOTSET = NoValue()
+    MISSING = NoValue()
+    CACHE_VALUES = False
+    THREADSAFE = False
+    # a `musette.metrics.Metrics` to instrument every instance with (see
+    # `set_metrics`)
+    METRICS = None
+    # parsed `*_url_config` results, shared by all instances (None disables)
+    URL_CONFIG_CACHE = LRUCache(256)
     BOOLEAN_TRUE_STRINGS = ('true', 'on', 'ok', 'y', 'yes', '1')
-    URL_CLASS = urlparse.ParseResult
+    URL_CLASS = _UrlClass()
     DEFAULT_DATABASE_ENV = 'DATABASE_URL'
     DB_SCHEMES = {
         'postgres': 'django.db.backends.postgresql_psycopg2',
@@ -112,9 +350,35 @@ class Environment(collections.MutableMapping):
     def __init__(self, init=None, **schema):
         if init is None:
             init = os.environ
+        self._setup(init, schema)
+
+    def _setup(self, init, schema, accessors=None, casts=None):
         self.__dict__['_environ'] = init
         self.__dict__['_schema'] = schema
+        self.__dict__['_casts'] = {} if casts is None else casts
+        if accessors is None:
+            accessors = self._compile_schema(schema)
+        self.__dict__['_accessors'] = accessors
         self.__dict__['_resolved'] = None
+        self.__dict__['_graph'] = DependencyGraph(init)
+        self.__dict__['_interpolated'] = {}
+        self.__dict__['_cache'] = {} if self.CACHE_VALUES else None
+        # the (files, defaults, overrides, iterator) of each call to `read`,
+        # in order, without repeats
+        self.__dict__['_sources'] = []
+        # the value (or NOTSET) of each key read, before it was first read,
+        # which a watcher restores if the key is removed from the files
+        self.__dict__['_original'] = {}
+        self.__dict__['_threadsafe'] = False
+        self.__dict__['_lock'] = _NOLOCK
+        self.__dict__['_snapshot'] = None
+        self.__dict__['_base'] = None
+        self.__dict__['_stale'] = set()
+        self.__dict__['_metrics'] = None
+        if self.THREADSAFE:
+            self.set_threadsafe()
+        if self.METRICS is not None:
+            self.set_metrics(self.METRICS)
 
     def __call__(self, var, cast=None, default=NOTSET):
         return self.get_value(var, cast=cast, default=default)
@@ -140,27 +404,44 @@ class Environment(collections.MutableMapping):
         return self.get_value(key)
 
     def __setitem__(self, key, value):
-        if self._resolved is not None and is_variable(value):
-            del self._resolved
-            self._resolved = None
-        self._environ[key] = value
+        with self._lock:
+            self._environ[key] = value
+            self._invalidate([key])
 
     def __delitem__(self, key):
-        del self._environ[key]
+        with self._lock:
+            del self._environ[key]
+            self._invalidate([key])
 
     def __iter__(self):
+        if self._threadsafe:
+            return iter(self._take_snapshot().values)
         return iter(self._environ)
 
     def __len__(self):
+        if self._threadsafe:
+            return len(self._take_snapshot().values)
         return len(self._environ)
 
     def get(self, key, default=None):
         return self.get_value(key, default=default)
 
     def copy(self):
-        return self.__class__(self._environ.copy(), **self._schema)
+        with self._lock:
+            copied = self._spawn(self._environ.copy())
+        copied.set_caching(self._cache is not None)
+        copied.set_threadsafe(self._threadsafe)
+        return copied
+
+    def _spawn(self, init):
+        # a new instance sharing this instance's compiled schema
+        env = self.__class__.__new__(self.__class__)
+        env._setup(init, self._schema, self._accessors, self._casts)
+        return env
 
     def keys(self):
+        if self._threadsafe:
+            return self._take_snapshot().values.keys()
         return self._environ.keys()
     ###########################################################################
 
@@ -174,17 +455,16 @@ class Environment(collections.MutableMapping):
 
     def __getattr__(self, key):
         if key[:2] != '__':
-            try:
-                return self.__getitem__(key)
-            except KeyError:
-                pass
+            value = self._get_value(key)
+            if value is not self.MISSING:
+                return value
         raise AttributeError(key)
 
     def __delattr__(self, key):
         try:
             del self.__dict__[key]
         except KeyError:
-            del self._environ[key]
+            self.__delitem__(key)
 
     def bool(self, var, default=NOTSET):
         """
@@ -208,6 +488,7 @@ class Environment(collections.MutableMapping):
         """
         :returns: Json parsed
         """
+        import json
         return self.get_value(var, cast=json.loads, default=default)
 
     def list(self, var, cast=None, default=NOTSET):
@@ -226,7 +507,7 @@ class Environment(collections.MutableMapping):
         """
         :rtype: urlparse.ParseResult
         """
-        return self.get_value(var, cast=urlparse.urlparse, default=default)
+        return self.get_value(var, cast=_urlparse().urlparse, default=default)
 
     def db_url(self, var=DEFAULT_DATABASE_ENV, default=NOTSET, engine=None):
         """Returns a config dictionary, defaulting to DATABASE_URL.
@@ -258,12 +539,303 @@ class Environment(collections.MutableMapping):
         """
         return self.search_url_config(self.url(var, default=default), engine=engine)
 
-    def resolved(self):
-        if self._resolved is None:
-            self._resolved = self.__class__(
-                interpolated(self._environ), **self._schema
+    @property
+    def lazy(self):
+        """Lazy versions of the shortcuts, eg. `env.lazy.db_url()`, which
+        return proxies that only look up and parse the value when first used.
+
+        :rtype: LazyEnvironment
+        """
+        from .lazy import LazyEnvironment
+        return LazyEnvironment(self)
+
+    def _invalidate(self, keys):
+        # only the changed keys and the keys that refer to them are stale
+        graph = self._graph
+        stale = graph.dependents(keys)
+        stale.update(keys)
+        for key in keys:
+            graph.discard(key)
+        memo = self._interpolated
+        cache = self._cache
+        for key in stale:
+            memo.pop(key, None)
+            if cache is not None:
+                cache.pop(key, None)
+        view = self._resolved
+        if self._threadsafe:
+            # copy-on-write: readers may hold the current snapshot and view,
+            # so new ones are made when next needed
+            self._stale.update(stale)
+            self._snapshot = None
+            self._resolved = None
+        elif view is not None:
+            try:
+                graph.update(view._environ, stale)
+            except (KeyError, ValueError):
+                # rebuild, and raise, on the next call to `resolved`
+                self._resolved = None
+            else:
+                view._invalidate(stale)
+
+    def _take_snapshot(self):
+        # the current snapshot, resolved by one thread while others wait
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None:
+                    snapshot = self._snapshot = self._resolve_snapshot()
+        return snapshot
+
+    def _resolve_snapshot(self):
+        # only the keys which are stale since the last snapshot are resolved,
+        # unless there were errors
+        graph = self._graph
+        base, stale = self._base, self._stale
+        values = None
+        if base is not None and not base.errors:
+            try:
+                values = graph.update(dict(base.values), stale)
+            except (KeyError, ValueError):
+                pass
+        errors = set()
+        if values is None:
+            try:
+                values = graph.resolve()
+            except (KeyError, ValueError):
+                # as `interpolate`, missing references give the raw value
+                values = dict(graph.values)
+                memo = {}
+                for key in values:
+                    try:
+                        values[key] = graph.resolve_key(key, memo)
+                    except KeyError:
+                        pass
+                    except ValueError:
+                        errors.add(key)
+        cache = {}
+        if base is not None:
+            cache = dict(
+                (k, v) for k, v in base.cache.items() if k not in stale
             )
-        return self._resolved
+        snapshot = self._base = _Snapshot(values, errors, cache)
+        self._stale = set()
+        return snapshot
+
+    def set_threadsafe(self, enabled=True):
+        """Make this environment safe to share between threads which modify
+        it, or not. Call it before the environment is shared.
+
+        When thread-safe, modifications are serialized by a lock, and reads
+        come from an immutable snapshot of the resolved values, which is
+        replaced (copy-on-write) rather than modified. After a modification
+        the next reader resolves a new snapshot while any others wait for it,
+        and only the changed keys and their dependents are resolved again.
+        Changes made to the underlying mapping other than through this object
+        aren't seen. The default is given by the `THREADSAFE` class attribute.
+        """
+        if enabled and not self._threadsafe:
+            import threading
+            self._lock = threading.RLock()
+            self._snapshot = self._base = self._resolved = None
+            self._stale = set()
+            self._threadsafe = True
+        elif not enabled and self._threadsafe:
+            with self._lock:
+                self._threadsafe = False
+                self._snapshot = self._base = self._resolved = None
+            self._lock = _NOLOCK
+
+    def set_metrics(self, metrics=True):
+        """Record metrics of the use of this environment in `metrics`, a
+        `musette.metrics.Metrics` (by default, a new one), which is returned;
+        or stop recording them if `metrics` is None.
+
+        The metrics are the lookups of each key, the time spent in
+        `get_value`, parsing values, interpolating, parsing URLs and reading
+        files, and the hit rates of the value and URL config caches. They
+        cost nothing while disabled. Copies of the environment aren't
+        instrumented. The default is given by the `METRICS` class attribute.
+        """
+        from .metrics import Metrics, instrument, uninstrument
+        if metrics is None or metrics is False:
+            uninstrument(self)
+            return None
+        if metrics is True:
+            metrics = Metrics()
+        instrument(self, metrics)
+        return metrics
+
+    def trace(self, at_exit=False):
+        """Record the keys read from this environment, with their casts and
+        call sites, and return the `musette.trace.Tracer`, whose `report`
+        lists the keys which were loaded but never read, and those which
+        were read but missing. If `at_exit`, the report is printed to stderr
+        when the process exits.
+
+        The tracer replaces any metrics being recorded (see `set_metrics`),
+        and records the same metrics itself.
+        """
+        from .trace import Tracer
+        tracer = self.set_metrics(Tracer())
+        if at_exit:
+            tracer.report_at_exit(self)
+        return tracer
+
+    @property
+    def metrics(self):
+        """The metrics being recorded (see `set_metrics`), or None."""
+        return self._metrics
+
+    def dependents(self, var, recursive=True):
+        """Return the set of keys whose values refer to `var`, either directly
+        or, if `recursive`, through other keys.
+        """
+        with self._lock:
+            self._graph.parse()
+            return self._graph.dependents([var], recursive)
+
+    def interpolate(self, var):
+        """Return the value of `var` with any variables substituted.
+
+        Only `var` and the keys it refers to (directly or indirectly) are
+        resolved, and the results are memoized per key until the environment
+        is next modified. If a referenced key is missing then the raw value
+        is returned.
+        """
+        with self._lock:
+            try:
+                return self._graph.resolve_key(var, self._interpolated)
+            except KeyError:
+                return self._environ[var]
+
+    def resolved(self):
+        view = self._resolved
+        if view is None:
+            with self._lock:
+                view = self._resolved
+                if view is None:
+                    view = self._resolved = self._spawn(self._graph.resolve())
+        return view
+
+    def freeze(self, names=(), name='Settings'):
+        """Read and cast every variable in the schema, plus any other `names`,
+        and return them as attributes of an immutable, slotted settings object
+        which can be shared between threads.
+
+        A KeyError is raised if a variable is missing and has no default, and
+        a ValueError if a name isn't a valid attribute name (eg. 'db.host').
+
+        Usage:::
+
+            env = Environment(DEBUG=(bool, False), DATABASE_URL=str)
+            settings = env.freeze()
+            if settings.DEBUG:
+                ...
+        """
+        keys = list(self._schema)
+        keys.extend(name for name in names if name not in self._schema)
+        values = self.extract(dict((key, None) for key in keys))
+        return frozen_settings(values, name)
+
+    def extract(self, schema):
+        """Return a dictionary of the values of the variables in `schema`, a
+        mapping of names to a cast or a (cast, default) pair, as given to the
+        constructor. A cast of None means the variable's cast in the schema of
+        this environment, if any.
+
+        This is equivalent to calling `get_value` for each variable, but the
+        variables are interpolated together in one pass, and rather than stop
+        at the first error, a `SettingsError` is raised which lists every
+        variable that is missing or can't be interpolated or cast.
+
+        Usage:::
+
+            settings = env.extract({
+                'DEBUG': (bool, False),
+                'ALLOWED_HOSTS': ([str], []),
+                'SECRET_KEY': str,
+            })
+        """
+        if self._threadsafe:
+            snapshot = self._take_snapshot()
+            environ, errors = snapshot.values, snapshot.errors
+        else:
+            environ, errors = self._environ, None
+        accessors = self._accessors
+        NOTSET = self.NOTSET
+        fields = []
+        raw = {}
+        variables = []
+        for var, (parse, default) in self._compile_schema(schema).items():
+            if var in accessors:
+                schema_parse, schema_default = accessors[var]
+                if parse is None:
+                    parse = schema_parse
+                if default is NOTSET:
+                    default = schema_default
+            fields.append((var, parse, default))
+            try:
+                value = raw[var] = environ[var]
+            except KeyError:
+                continue
+            if errors is None:
+                if value and is_variable(value):
+                    variables.append(var)
+            elif var in errors:
+                variables.append(var)
+        invalid = {}
+        if variables:
+            with self._lock:
+                memo = self._interpolated
+                try:
+                    self._graph.resolve_keys(variables, memo)
+                except (KeyError, ValueError):
+                    # resolve what can be, one at a time
+                    pass
+                for var in variables:
+                    try:
+                        raw[var] = self.interpolate(var)
+                    except ValueError as e:
+                        invalid[var] = e
+        values = {}
+        missing = []
+        for var, parse, default in fields:
+            if var in invalid:
+                continue
+            try:
+                value = raw[var]
+            except KeyError:
+                if default is NOTSET:
+                    missing.append(var)
+                else:
+                    values[var] = default
+                continue
+            if parse is not None and value is not None:
+                try:
+                    value = parse(value)
+                except Exception as e:
+                    invalid[var] = e
+                    continue
+            values[var] = value
+        if missing or invalid:
+            raise SettingsError(sorted(missing), invalid)
+        return values
+
+    def set_caching(self, enabled=True):
+        """Enable or disable caching of `get_value` results.
+
+        Results are cached per variable, cast and default, including the
+        fact that a variable is missing, and are discarded when the variable
+        (or any variable it refers to) is modified through this object. Cached
+        lists and dicts are shared between callers and shouldn't be mutated.
+        The default is given by the `CACHE_VALUES` class attribute.
+        """
+        if not enabled:
+            self._cache = None
+        elif self._cache is None:
+            self._cache = {}
 
     def get_value(self, var, cast=None, default=NOTSET):
         """Return value for given environment variable.
@@ -274,46 +846,159 @@ class Environment(collections.MutableMapping):
 
         :returns: Value from environment or default (if set)
         """
-        logger.debug("get '{0}' casted as '{1}' with default '{2}'".format(var, cast, default))
+        value = self._get_value(var, cast, default)
+        if value is self.MISSING:
+            #error_msg = "Set the {0} environment variable".format(var)
+            raise KeyError(var)
+        return value
+
+    def _get_value(self, var, cast=None, default=NOTSET):
+        # as `get_value`, but returns MISSING rather than raise KeyError
+        if self._threadsafe:
+            snapshot = self._snapshot or self._take_snapshot()
+            environ = snapshot.values
+            cache = None if self._cache is None else snapshot.cache
+        else:
+            snapshot = None
+            environ = self._environ
+            cache = self._cache
+        # keyed on the type of the default too, as eg. 0 == False
+        key = cast, type(default), default
+        if cache is not None:
+            try:
+                return cache[var][key]
+            except (KeyError, TypeError):
+                # not cached, or an unhashable cast or default
+                pass
+        _debug("get '%s' casted as '%s' with default '%s'", var, cast, default)
         try:
-            var_info = self._schema[var]
+            schema_parse, schema_default = self._accessors[var]
         except KeyError:
-            pass
+            parse = None if cast is None else self._caster(cast)
         else:
-            try:
-                has_default = len(var_info) == 2
-            except TypeError:
-                has_default = False
-            if has_default:
-                if not cast:
-                    cast = var_info[0]
-
-                if default is self.NOTSET:
-                    try:
-                        default = var_info[1]
-                    except IndexError:
-                        pass
-            else:
-                if not cast:
-                    cast = var_info
+            parse = self._caster(cast) if cast else schema_parse
+            if default is self.NOTSET:
+                default = schema_default
         try:
-            value = self._environ[var]
+            value = environ[var]
         except KeyError:
             if default is self.NOTSET:
-                #error_msg = "Set the {0} environment variable".format(var)
-                raise
-            value = default
-        if value is not default:
-            value = self.parse_value(value, cast)
-        if value and is_variable(value):
+                value = self.MISSING
+            else:
+                value = default
+        else:
+            if snapshot is None:
+                if value and is_variable(value):
+                    value = self.interpolate(var)
+            elif snapshot.errors and var in snapshot.errors:
+                # raises
+                value = self.interpolate(var)
+            if parse is not None and value is not None:
+                value = parse(value)
+        if cache is not None:
             try:
-                return self.resolved()._environ[var]
-            except KeyError:
+                cache.setdefault(var, {})[key] = value
+            except TypeError:
                 pass
         return value
 
     # Class and static methods
 
+    def _compile_schema(self, schema):
+        # {var: cast or (cast, default)} -> {var: (parse function, default)}
+        accessors = {}
+        for var, var_info in schema.items():
+            if isinstance(var_info, (tuple, list)) and len(var_info) == 2:
+                cast, default = var_info
+            else:
+                cast, default = var_info, self.NOTSET
+            accessors[var] = (self._caster(cast), default)
+        return accessors
+
+    def _caster(self, cast):
+        # memoized `compile_cast`
+        try:
+            return self._casts[cast]
+        except KeyError:
+            parse = self._casts[cast] = self.compile_cast(cast)
+        except TypeError:
+            # unhashable, eg. [int] or dict(value=int)
+            parse = self.compile_cast(cast)
+        return parse
+
+    def _parse_overridden(self):
+        # whether a subclass overrides `parse_value`, eg. to add casts
+        method = type(self).parse_value
+        return (
+            getattr(method, '__func__', method) is not
+            Environment.__dict__['parse_value']
+        )
+
+    def compile_cast(self, cast):
+        """Return a function which parses and casts a (non-None) stringed
+        value as described by `cast`, or None if no cast is required.
+
+        See `parse_value` for the supported casts. If a subclass overrides
+        `parse_value`, the function calls it, so that any casts it adds are
+        still applied; overriding this method instead is faster, as the
+        function is compiled once per cast.
+        """
+        if cast is None:
+            return None
+        if self._parse_overridden():
+            parse_value = self.parse_value
+            return lambda value: parse_value(value, cast)
+        return self._compile_cast(cast)
+
+    def _compile_cast(self, cast):
+        if cast is bool:
+            true_strings = self.BOOLEAN_TRUE_STRINGS
+            def parse(value):
+                try:
+                    return int(value) != 0
+                except ValueError:
+                    return value.lower() in true_strings
+        elif isinstance(cast, list):
+            item_cast = cast[0]
+            def parse(value):
+                return list(map(item_cast, [x for x in value.split(',') if x]))
+        elif isinstance(cast, dict):
+            key_cast = cast.get('key', str)
+            value_parse = self._caster(cast.get('value', text_type))
+            value_parse_by_key = dict(
+                (k, self._caster(v)) for k, v in cast.get('cast', dict()).items()
+            )
+            def parse_item(kv):
+                value_parse_ = value_parse_by_key.get(kv[0], value_parse)
+                value = kv[1]
+                if value_parse_ is not None:
+                    value = value_parse_(value)
+                return key_cast(kv[0]), value
+            def parse(value):
+                return dict(map(
+                    parse_item, [val.split('=') for val in value.split(';') if val]
+                ))
+        elif cast is dict:
+            def parse(value):
+                return dict([val.split('=') for val in value.split(',') if val])
+        elif cast is list:
+            def parse(value):
+                return [x for x in value.split(',') if x]
+        elif cast is float:
+            def parse(value):
+                # clean string
+                float_str = _FLOAT_JUNK.sub('', value)
+                # split for avoid thousand separator and different locale comma/dot symbol
+                parts = _FLOAT_SEPARATOR.split(float_str)
+                if len(parts) == 1:
+                    float_str = parts[0]
+                else:
+                    float_str = "{0}.{1}".format(''.join(parts[0:-1]), parts[-1])
+                return float(float_str)
+        else:
+            parse = cast
+        return parse
+
     def parse_value(self, value, cast):
         """Parse and cast provided value
 
@@ -322,43 +1007,16 @@ class Environment(collections.MutableMapping):
 
         :returns: Casted value
         """
-        if value is None:
-            return value
-        elif cast is None:
+        if value is None or cast is None:
             return value
-        elif cast is bool:
-            try:
-                value = int(value) != 0
-            except ValueError:
-                value = value.lower() in self.BOOLEAN_TRUE_STRINGS
-        elif isinstance(cast, list):
-            value = list(map(cast[0], [x for x in value.split(',') if x]))
-        elif isinstance(cast, dict):
-            key_cast = cast.get('key', str)
-            value_cast = cast.get('value', text_type)
-            value_cast_by_key = cast.get('cast', dict())
-            value = dict(map(
-                lambda kv: (key_cast(kv[0]), self.parse_value(kv[1], value_cast_by_key.get(kv[0], value_cast))),
-                [val.split('=') for val in value.split(';') if val]
-            ))
-        elif cast is dict:
-            value = dict([val.split('=') for val in value.split(',') if val])
-        elif cast is list:
-            value = [x for x in value.split(',') if x]
-        elif cast is float:
-            # clean string
-            float_str = re.sub(r'[^\d,\.]', '', value)
-            # split for avoid thousand separator and different locale comma/dot symbol
-            parts = re.split(r'[,\.]', float_str)
-            if len(parts) == 1:
-                float_str = parts[0]
-            else:
-                float_str = "{0}.{1}".format(''.join(parts[0:-1]), parts[-1])
-            value = float(float_str)
+        if self._parse_overridden():
+            # called by the override, so compiled without it
+            parse = self._compile_cast(cast)
         else:
-            value = cast(value)
-        return value
+            parse = self._caster(cast)
+        return parse(value)
 
+    @_memoized_config
     def db_url_config(self, url, engine=None):
         """Pulled from DJ-Database-URL, parse an arbitrary Database URL.
         Support currently exists for PostgreSQL, PostGIS, MySQL and SQLite.
@@ -384,7 +1042,7 @@ class Environment(collections.MutableMapping):
                     'NAME': ':memory:'
                 }
                 # note: no other settings are required for sqlite
-            url = urlparse.urlparse(url)
+            url = _urlparse().urlparse(url)
 
         config = {}
 
@@ -412,7 +1070,7 @@ class Environment(collections.MutableMapping):
 
         if url.query:
             config_options = {}
-            for k, v in urlparse.parse_qs(url.query).items():
+            for k, v in _urlparse().parse_qs(url.query).items():
                 if k.upper() in self._DB_BASE_OPTIONS:
                     config.update({k.upper(): _cast_int(v[0])})
                 else:
@@ -425,11 +1083,13 @@ class Environment(collections.MutableMapping):
             config['ENGINE'] = Environment.DB_SCHEMES[url.scheme]
 
         if not config.get('ENGINE', False):
+            import warnings
             warnings.warn("Engine not recognized from url: {0}".format(config))
             return {}
 
         return config
 
+    @_memoized_config
     def cache_url_config(self, url, backend=None):
         """Pulled from DJ-Cache-URL, parse an arbitrary Cache URL.
 
@@ -437,7 +1097,7 @@ class Environment(collections.MutableMapping):
         :param overrides:
         :return:
         """
-        url = urlparse.urlparse(url) if not isinstance(url, self.URL_CLASS) else url
+        url = _urlparse().urlparse(url) if not isinstance(url, self.URL_CLASS) else url
 
         location = url.netloc.split(',')
         if len(location) == 1:
@@ -460,7 +1120,7 @@ class Environment(collections.MutableMapping):
 
         if url.query:
             config_options = {}
-            for k, v in urlparse.parse_qs(url.query).items():
+            for k, v in _urlparse().parse_qs(url.query).items():
                 opt = {k.upper(): _cast_int(v[0])}
                 if k.upper() in self._CACHE_BASE_OPTIONS:
                     config.update(opt)
@@ -473,12 +1133,13 @@ class Environment(collections.MutableMapping):
 
         return config
 
+    @_memoized_config
     def email_url_config(self, url, backend=None):
         """Parses an email URL."""
 
         config = {}
 
-        url = urlparse.urlparse(url) if not isinstance(url, self.URL_CLASS) else url
+        url = _urlparse().urlparse(url) if not isinstance(url, self.URL_CLASS) else url
 
         # Remove query strings
         path = url.path[1:]
@@ -505,7 +1166,7 @@ class Environment(collections.MutableMapping):
 
         if url.query:
             config_options = {}
-            for k, v in urlparse.parse_qs(url.query).items():
+            for k, v in _urlparse().parse_qs(url.query).items():
                 opt = {k.upper(): _cast_int(v[0])}
                 if k.upper() in self._EMAIL_BASE_OPTIONS:
                     config.update(opt)
@@ -515,10 +1176,11 @@ class Environment(collections.MutableMapping):
 
         return config
 
+    @_memoized_config
     def search_url_config(self, url, engine=None):
         config = {}
 
-        url = urlparse.urlparse(url) if not isinstance(url, self.URL_CLASS) else url
+        url = _urlparse().urlparse(url) if not isinstance(url, self.URL_CLASS) else url
 
         # Remove query strings.
         path = url.path[1:]
@@ -540,7 +1202,7 @@ class Environment(collections.MutableMapping):
             index = split[0]
 
         config.update({
-            "URL": urlparse.urlunparse(("http",) + url[1:2] + (path,) + url[3:]),
+            "URL": _urlparse().urlunparse(("http",) + url[1:2] + (path,) + url[3:]),
             "INDEX_NAME": index,
             })
 
@@ -568,27 +1230,20 @@ class Environment(collections.MutableMapping):
             frame = sys._getframe()
             env_file = os.path.join(os.path.dirname(frame.f_back.f_code.co_filename), '.env')
             if not os.path.exists(env_file):
+                import warnings
                 warnings.warn("not reading %s - it doesn't exist." % env_file)
                 return
 
-        def iterator(iterable):
-            for line in iterable:
-                m1 = re.match(r'\A([A-Za-z_0-9]+)=(.*)\Z', line)
-                if m1:
-                    key, val = m1.group(1), m1.group(2)
-                    m2 = re.match(r"\A'(.*)'\Z", val)
-                    if m2:
-                        val = m2.group(1)
-                    m3 = re.match(r'\A"(.*)"\Z', val)
-                    if m3:
-                        val = re.sub(r'\\(.)', r'\1', m3.group(1))
-                    yield key, text_type(val)
-
-        self.read(env_file, overrides=overrides, iterator=iterator)
+        from .dotenv import iter_dotenv
+        self.read(env_file, overrides=overrides, iterator=iter_dotenv)
 
-    def read(self, files, defaults=None, overrides=None, iterator=None):
+    def read(self, files, defaults=None, overrides=None, iterator=None,
+            cache_dir=None, threads=None, processes=None):
         """
-        Populate the environment dictionary from one or more files.
+        Populate the environment dictionary from one or more files, which
+        may include directories and glob patterns (eg. 'conf.d/*.properties').
+        Matching files are read in order of name, concurrently, and later
+        files take precedence.
 
         Interpolates values in the format $var or ${var}. If an interpolation
         target is missing, a KeyError is raised; and if any key is an invalid
@@ -596,10 +1251,72 @@ class Environment(collections.MutableMapping):
 
         The default file iterator will determine key/value pairs by splitting
         lines on both '=' and ':='.
+
+        If `cache_dir` is given, the parsed result is cached there between
+        processes (see `resolve_files`), and if `processes` is given, large
+        property files are scanned in that many processes.
         """
         if isinstance(files, basestring) or hasattr(files, 'read'):
             files = [files]
-        self._environ.update(resolve_files(files, defaults, overrides, iterator))
+        values = self._resolve_files(
+            files, defaults, overrides, iterator, cache_dir, threads, processes
+        )
+        self._load(values, files, defaults, overrides, iterator)
+
+    # an attribute, so that it can be timed by `set_metrics`
+    _resolve_files = staticmethod(resolve_files)
+
+    def _load(self, values, files, defaults=None, overrides=None,
+            iterator=None):
+        # add the `values` read from `files`
+        with self._lock:
+            environ = self._environ
+            original = self._original
+            for key in values:
+                if key not in original:
+                    original[key] = environ.get(key, self.NOTSET)
+            environ.update(values)
+            self._invalidate(values)
+            if all(isinstance(f, basestring) for f in files):
+                # for `watch`; open files can't be read again. Reading the
+                # same files again moves them last, rather than adding them,
+                # so a process which reloads doesn't grow the list
+                source = (list(files), defaults, overrides, iterator)
+                key = _source_key(*source)
+                sources = [
+                    s for s in self._sources if _source_key(*s) != key
+                ]
+                sources.append(source)
+                # replaced, so that a watcher can iterate over it unlocked
+                self._sources = sources
+
+    def _apply(self, values, removed=()):
+        # replace and remove values in one batch
+        with self._lock:
+            environ = self._environ
+            environ.update(values)
+            for key in removed:
+                environ.pop(key, None)
+            keys = set(values)
+            keys.update(removed)
+            self._invalidate(keys)
+
+    def watch(self, callback=None, interval=1.0, inotify=None):
+        """Start reloading the files read by `read` and `read_env` whenever
+        they change, in a background thread, and return the `Watcher`.
+
+        `callback`, if given, is subscribed to the `ChangeEvent` sent for
+        each change. The environment is made thread-safe (see
+        `set_threadsafe`), as it's then modified by that thread. See
+        `musette.watch.Watcher` for the other arguments.
+        """
+        from .watch import Watcher
+        self.set_threadsafe()
+        watcher = Watcher(self, interval=interval, inotify=inotify)
+        if callback is not None:
+            watcher.subscribe(callback)
+        watcher.start()
+        return watcher
 
     def pprint(
         self, stream=sys.stdout, maxlines=-1, safe=False, encoding='utf-8',
@@ -641,17 +1358,20 @@ class Environment(collections.MutableMapping):
                 line += 1
         stream.write(b'\n')
 
-environ = Environment()
-
-
-def register_scheme(scheme):
-    for method in filter(lambda s: s.startswith('uses_'), dir(urlparse)):
-        getattr(urlparse, method).append(scheme)
-
-# Register database and cache schemes in URLs.
-_SCHEMES = []
-for schtype in ['DB', 'CACHE', 'SEARCH', 'EMAIL']:
-    _SCHEMES.extend(getattr(Environment, schtype + '_SCHEMES').keys())
-for schema in _SCHEMES:
-    register_scheme(schema)
 
+def __getattr__(name):
+    # the default `environ` is created on first use (Python >= 3.7; earlier
+    # versions create it eagerly, below), and so are `urlparse` and `logger`
+    global environ
+    if name == 'environ':
+        environ = Environment()
+        return environ
+    if name == 'urlparse':
+        return _urlparse()
+    if name == 'logger':
+        import logging
+        return logging.getLogger(__file__)
+    raise AttributeError(name)
+
+if sys.version_info < (3, 7):
+    environ = Environment()
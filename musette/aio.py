@@ -0,0 +1,152 @@
+"""
+asyncio versions of `resolve_files`, `Environment.read` and `read_env`
+(Python 3.5+).
+
+Files are read and parsed in an executor (by default the event loop's), so
+the event loop isn't blocked, and the results are applied to the environment
+on the event loop's thread, in one update. Concurrent calls with the same
+arguments share loads: a call made while an identical load is in progress
+can't use its result, as a file may have changed since it started, so it
+waits for a follow-up load, started once that one is done, which it shares
+with any other calls made meanwhile.
+
+Usage:::
+
+    from musette import environ
+    from musette.aio import aread
+
+    async def reload():
+        await aread(environ, 'conf.d/')
+"""
+import os
+import sys
+import asyncio
+import functools
+
+from .compat import basestring
+from .interpolation import resolve_files
+
+# (loop, key): [future of the load in progress, future of its follow-up]
+_loads = {}
+
+
+def _key(*args):
+    # a hashable key for a load, or None
+    key = []
+    for arg in args:
+        if isinstance(arg, dict):
+            arg = tuple(sorted(arg.items()))
+        elif isinstance(arg, list):
+            arg = tuple(arg)
+        key.append(arg)
+    key = tuple(key)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _coalesce(key, load):
+    # run the coroutine function `load` and return a future of its result;
+    # or, if a load with the same key is in progress on this loop, once it
+    # is done, sharing that follow-up with other calls made meanwhile
+    loop = asyncio.get_event_loop()
+    if key is None:
+        return asyncio.ensure_future(load())
+    key = (loop, key)
+    loads = _loads.get(key)
+    if loads is None:
+        future = asyncio.ensure_future(load())
+        _loads[key] = [future, None]
+        future.add_done_callback(functools.partial(_done, key))
+        return future
+    if loads[1] is None:
+        loads[1] = asyncio.ensure_future(_follow(loads[0], load))
+    return loads[1]
+
+
+async def _follow(future, load):
+    # `load` after `future`, whatever its outcome
+    await asyncio.wait([future])
+    return await load()
+
+
+def _done(key, future):
+    # the follow-up of `future`, if any, is now the load in progress
+    loads = _loads.get(key)
+    if loads is None or loads[0] is not future:
+        return
+    if loads[1] is None:
+        del _loads[key]
+    else:
+        loads[:] = [loads[1], None]
+        loads[0].add_done_callback(functools.partial(_done, key))
+
+
+async def aresolve_files(files, defaults=None, overrides=None, iterator=None,
+        cache_dir=None, threads=None, executor=None, processes=None):
+    """As `resolve_files`, run in `executor`."""
+    if isinstance(files, basestring):
+        files = [files]
+    loop = asyncio.get_event_loop()
+    call = functools.partial(
+        resolve_files, files, defaults, overrides, iterator, cache_dir, threads,
+        processes,
+    )
+
+    async def load():
+        return await loop.run_in_executor(executor, call)
+
+    key = _key(
+        files, defaults, overrides, iterator, cache_dir, threads, processes
+    )
+    # shielded, so that one caller being cancelled doesn't cancel the others
+    return await asyncio.shield(_coalesce(key, load))
+
+
+async def aread(env, files, defaults=None, overrides=None, iterator=None,
+        cache_dir=None, threads=None, executor=None, processes=None):
+    """As `Environment.read`, with the files read and parsed in `executor`."""
+    if isinstance(files, basestring) or hasattr(files, 'read'):
+        files = [files]
+
+    async def load():
+        values = await aresolve_files(
+            files, defaults, overrides, iterator, cache_dir, threads, executor,
+            processes,
+        )
+        env._load(values, files, defaults, overrides, iterator)
+
+    key = _key(
+        id(env), files, defaults, overrides, iterator, cache_dir, threads,
+        processes,
+    )
+    await asyncio.shield(_coalesce(key, load))
+
+
+def aread_env(env, env_file=None, executor=None, **overrides):
+    """As `Environment.read_env`, with the file read and parsed in `executor`.
+
+    Returns an awaitable. As with `read_env`, if no `env_file` is given then
+    the '.env' file in the directory of the calling module is read, if it
+    exists.
+    """
+    from .dotenv import iter_dotenv
+    if env_file is None:
+        frame = sys._getframe()
+        env_file = os.path.join(
+            os.path.dirname(frame.f_back.f_code.co_filename), '.env'
+        )
+        if not os.path.exists(env_file):
+            import warnings
+            warnings.warn("not reading %s - it doesn't exist." % env_file)
+            return _noop()
+    return aread(
+        env, env_file, overrides=overrides, iterator=iter_dotenv,
+        executor=executor,
+    )
+
+
+async def _noop():
+    pass
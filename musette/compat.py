@@ -1,6 +1,12 @@
 
 import sys
-from collections import deque
+from collections import deque, OrderedDict
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    # Python 2
+    from collections import MutableMapping
 
 if sys.version < '3':
     text_type = unicode
@@ -136,3 +142,44 @@ try:
 except ImportError:
     from cStringIO import StringIO as BytesIO
 
+try:
+    from os import replace
+except ImportError:
+    # Python 2 - rename is atomic, and overwrites, on posix
+    from os import rename as replace
+
+
+def atomic_write(path, data):
+    """Write the bytes `data` to `path` through a temporary file which then
+    replaces it, so that concurrent readers see either the old or the new
+    content. The directory is created if need be.
+    """
+    import os
+    import tempfile
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        replace(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
+
+
+def __getattr__(name):
+    # `pickle` is only imported when it is needed (Python >= 3.7; earlier
+    # versions import it eagerly, below)
+    if name == 'pickle':
+        global pickle
+        try:
+            import cPickle as pickle
+        except ImportError:
+            import pickle
+        return pickle
+    raise AttributeError(name)
+
+if sys.version_info < (3, 7):
+    __getattr__('pickle')
@@ -0,0 +1,71 @@
+"""
+Parsing of '.env' files.
+"""
+import re
+
+from .compat import basestring, text_type
+
+# One assignment per match. Quoted values may span lines; anything on a line
+# which doesn't match (eg. comments) is skipped.
+_ASSIGNMENT = re.compile(r'''
+    ^[ \t]*
+    (?:export[ \t]+)?
+    ([A-Za-z_0-9]+)                         # key
+    [ \t]*=
+    (?:
+        [ \t]*'([^']*)'                     # single quoted, taken literally
+        [ \t]*(?:\#[^\n]*)?[ \t\r]*$
+      |
+        [ \t]*"((?:[^"\\]|\\[\s\S])*)"      # double quoted, with escapes
+        [ \t]*(?:\#[^\n]*)?[ \t\r]*$
+      |
+        ([^\n]*)                            # unquoted, verbatim
+    )
+''', re.M | re.X)
+
+_INLINE_COMMENT = re.compile(r'[ \t]+#.*')
+
+_ESCAPE = re.compile(r'\\([\s\S])')
+
+_ESCAPES = {'n': '\n', 'r': '\r', 't': '\t'}
+
+def _unescape(m):
+    c = m.group(1)
+    return _ESCAPES.get(c, c)
+
+def iter_dotenv(iterable):
+    """Yield the key/value pairs of a '.env' file, given either its content
+    or an iterable of its lines (eg. an open file).
+
+    Lines are of the form `KEY=value`, optionally prefixed with `export`.
+    Values may be single quoted (taken literally), double quoted (where
+    backslash escapes `\\n`, `\\r` and `\\t` are expanded and any other
+    escaped character is taken literally), or unquoted, in which case the
+    value is everything after the '=' up to a '#' preceded by whitespace,
+    which starts a comment, less any trailing whitespace. Quoted values may
+    span several lines. Blank lines, comments and malformed lines are
+    ignored.
+
+    The whole content is tokenized in a single pass of a precompiled regular
+    expression.
+    """
+    if isinstance(iterable, basestring):
+        buf = iterable
+    elif hasattr(iterable, 'read'):
+        buf = iterable.read()
+    else:
+        buf = '\n'.join(line.rstrip('\n') for line in iterable)
+    for m in _ASSIGNMENT.finditer(buf):
+        key, single, double, unquoted = m.groups()
+        if single is not None:
+            val = single
+        elif double is not None:
+            val = double
+            if '\\' in val:
+                val = _ESCAPE.sub(_unescape, val)
+        else:
+            val = unquoted
+            if '#' in val:
+                val = _INLINE_COMMENT.sub('', val)
+            val = val.rstrip()
+        yield key, text_type(val)
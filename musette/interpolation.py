@@ -1,58 +1,324 @@
 
 import os
+import re
 import sys
 from itertools import chain
 from string import Template as StringTemplate
-import logging
 
+# glob, warnings, hashlib, tempfile, pickle, multiprocessing, logging and the
+# dotenv parser are imported where they are used, as most imports never need
+# them
 from .compat import ExitStack, basestring
+from .properties import iter_properties, scan_properties
 
-logger = logging.getLogger(__file__)
+# the maximum number of threads used to read files concurrently
+READ_THREADS = 8
+# the number of files from which they are read concurrently by default, as
+# starting the threads costs more than reading a few local files
+READ_CONCURRENTLY = 32
+
+_GLOB_MAGIC = re.compile('[*?[]')
 
 def is_variable(value):
     try:
+        if StringTemplate.delimiter not in value:
+            return False
         return bool(StringTemplate.pattern.search(value))
     except TypeError:
         return False
 
-def iter_properties(iterable):
-    """Split lines on '=' and ':=' ignoring blank lines and comments.
+class MissingReferenceError(KeyError):
+    """Raised when a value refers to a variable that is not defined.
+
+    `path` is the chain of keys leading from the requested key to the missing
+    variable, eg. ``['fab', 'fee', 'typo']``.
+    """
+
+    def __init__(self, path):
+        self.path = list(path)
+        KeyError.__init__(self, ' -> '.join(self.path))
+
+
+class CircularReferenceError(ValueError):
+    """Raised when a chain of variables refers back to itself.
+
+    `path` is the full cycle, starting and ending with the same key.
+    """
+
+    def __init__(self, path):
+        self.path = list(path)
+        ValueError.__init__(
+            self, 'circular reference: ' + ' -> '.join(self.path)
+        )
+
+
+def compile_template(value):
+    """Compile a `string.Template` style string into a list of alternating
+    literal text and variable names, which begins and ends with literal text.
+    Return None if `value` isn't a string or has no placeholders at all, in
+    which case it is used as is.
+
+    Raises ValueError for ill-formed placeholders.
+    """
+    delimiter = StringTemplate.delimiter
+    try:
+        if not value or delimiter not in value:
+            return None
+    except TypeError:
+        return None
+    segments = []
+    literal = []
+    pos = 0
+    for m in StringTemplate.pattern.finditer(value):
+        literal.append(value[pos:m.start()])
+        pos = m.end()
+        name = m.group('named') or m.group('braced')
+        if name is not None:
+            segments.append(''.join(literal))
+            segments.append(name)
+            literal = []
+        elif m.group('escaped') is not None:
+            literal.append(delimiter)
+        else:
+            raise ValueError(
+                "Invalid placeholder in string: {0!r}".format(value)
+            )
+    literal.append(value[pos:])
+    segments.append(''.join(literal))
+    return segments
+
+
+def substitute(segments, context):
+    """Join compiled `segments` replacing each variable name with its value
+    in `context`.
+    """
+    parts = list(segments)
+    for i in range(1, len(parts), 2):
+        parts[i] = '%s' % (context[parts[i]],)
+    return ''.join(parts)
+
+
+def _names(segments):
+    names = []
+    if segments is not None:
+        for name in segments[1::2]:
+            if name not in names:
+                names.append(name)
+    return tuple(names)
+
+
+def references(value):
+    """Return the names of the variables referred to by `value`, in order of
+    appearance. Non-string values have no references.
+
+    Raises ValueError for ill-formed placeholders.
+    """
+    return _names(compile_template(value))
+
+
+class DependencyGraph(object):
+    """The variable references within a dictionary of values.
+
+    Each value is compiled at most once, and only when it is first needed.
+    `order` returns keys so that every key comes after the keys it depends on,
+    and `resolve` and `resolve_key` then substitute each value exactly once
+    in that order.
     """
-    for line in iterable:
-        if not line.isspace() and not line.startswith('#'):
-            key, sep, val = line.partition(':=')
-            if not sep:
-                key, sep, val = line.partition('=')
-            if not key.isspace() and sep:
-                yield key.strip(), val.strip()
+
+    _VISITING, _DONE = 1, 2
+
+    def __init__(self, d):
+        self.values = d
+        self.templates = {}
+        self.refs = {}
+        self.index = {}
+        # key: the error compiling its value, found by `parse`
+        self.errors = {}
+
+    def references(self, key):
+        """Return the (cached) names referred to by the value of `key`."""
+        try:
+            return self.refs[key]
+        except KeyError:
+            template = compile_template(self.values[key])
+            self.templates[key] = template
+            refs = self.refs[key] = _names(template)
+            index = self.index
+            for name in refs:
+                try:
+                    index[name].add(key)
+                except KeyError:
+                    index[name] = set([key])
+            return refs
+
+    def parse(self):
+        """Parse every value that hasn't been parsed yet.
+
+        A value which can't be compiled (eg. with an invalid placeholder) is
+        taken to refer to nothing, and its error is recorded in `errors`; it
+        is raised again by anything which needs the value resolved.
+        """
+        errors = self.errors
+        for key in self.values:
+            if key not in self.refs and key not in errors:
+                try:
+                    self.references(key)
+                except ValueError as e:
+                    errors[key] = e
+
+    def discard(self, key):
+        """Forget the parsed references of `key`, eg. after it has changed."""
+        self.templates.pop(key, None)
+        self.errors.pop(key, None)
+        for name in self.refs.pop(key, ()):
+            self.index[name].discard(key)
+
+    def dependents(self, keys, recursive=True):
+        """Return the set of keys whose values refer to any of `keys`, either
+        directly or, if `recursive`, through other keys.
+
+        Only values which have already been parsed are considered; call
+        `parse` first for a complete answer.
+        """
+        index = self.index
+        found = set()
+        todo = list(keys)
+        while todo:
+            for k in index.get(todo.pop(), ()):
+                if k not in found:
+                    found.add(k)
+                    if recursive:
+                        todo.append(k)
+        return found
+
+    def order(self, keys=None, context=None, resolved=()):
+        """Return `keys` (default: all keys) and their transitive dependencies
+        in dependency order. Keys in `resolved` are taken as already resolved
+        and are neither visited nor returned.
+
+        Raises MissingReferenceError if a reference is neither a key of the
+        graph nor of `context`, and CircularReferenceError on a cycle. Both
+        errors are raised before anything is substituted.
+        """
+        values = self.values
+        if context is None:
+            context = values
+        if keys is None:
+            keys = values
+        state = {}
+        order = []
+        for root in keys:
+            if root in state or root in resolved:
+                continue
+            if root not in values:
+                raise MissingReferenceError([root])
+            state[root] = self._VISITING
+            stack = [(root, iter(self.references(root)))]
+            while stack:
+                node, children = stack[-1]
+                for child in children:
+                    if child in resolved:
+                        continue
+                    if child not in values:
+                        if child not in context:
+                            path = [k for k, _ in stack]
+                            raise MissingReferenceError(path + [child])
+                        continue
+                    seen = state.get(child)
+                    if seen is None:
+                        state[child] = self._VISITING
+                        stack.append((child, iter(self.references(child))))
+                        break
+                    if seen == self._VISITING:
+                        path = [k for k, _ in stack]
+                        path = path[path.index(child):]
+                        raise CircularReferenceError(path + [child])
+                else:
+                    stack.pop()
+                    state[node] = self._DONE
+                    order.append(node)
+        return order
+
+    def _substitute(self, keys, context):
+        values = self.values
+        templates = self.templates
+        for k in keys:
+            template = templates[k]
+            if template is None:
+                context[k] = values[k]
+            else:
+                context[k] = substitute(template, context)
+        return context
+
+    def resolve(self, context=None, keys=None, resolved=()):
+        """Substitute values in dependency order and return `context` updated
+        with the results.
+        """
+        if context is None:
+            context = dict(self.values)
+        return self._substitute(self.order(keys, context, resolved), context)
+
+    def update(self, context, keys):
+        """Re-resolve `keys` within `context`, a dictionary which holds the
+        resolved values of the graph, after `keys` have changed.
+
+        `keys` must include every key that depends on a changed key. All other
+        keys in `context` are taken as up to date and aren't substituted
+        again. Keys no longer in the graph are removed from `context`.
+        """
+        stale = set(keys)
+        values = self.values
+        for k in stale:
+            if k not in values:
+                context.pop(k, None)
+        keys = [k for k in stale if k in values]
+        return self.resolve(context, keys, _Unchanged(context, stale))
+
+    def resolve_key(self, key, memo):
+        """Return the resolved value of `key`.
+
+        Only `key` and its transitive dependencies are substituted, and every
+        value resolved along the way is stored in the `memo` dictionary, which
+        is also consulted before anything is resolved again.
+        """
+        try:
+            return memo[key]
+        except KeyError:
+            pass
+        return self.resolve_keys([key], memo)[key]
+
+    def resolve_keys(self, keys, memo):
+        """As `resolve_key`, for several keys in a single pass, returning the
+        updated `memo`.
+        """
+        return self._substitute(self.order(keys, resolved=memo), memo)
+
+
+class _Unchanged(object):
+    """The keys of `context` excluding those in `stale`."""
+
+    def __init__(self, context, stale):
+        self.context = context
+        self.stale = stale
+
+    def __contains__(self, key):
+        return key not in self.stale and key in self.context
+
 
 def interpolated(d, context=None):
-    """Recursively interpolate dictionary values.
+    """Interpolate dictionary values.
 
     The expected interpolation format is that defined within the stdlib
     `string.Template` class::
 
         $foo or ${foo}
 
-    Will raise KeyError for missing keys and ValueError for invalid keys.
+    Will raise KeyError for missing keys and ValueError for invalid keys or
+    circular references.
     """
     if context is None:
         context = dict(d)
-    unresolved = {}
-    for k,v in d.items():
-        if v:
-            try:
-                v = StringTemplate(v).substitute(context)
-            except TypeError:
-                pass
-            else:
-                if StringTemplate.pattern.search(v):
-                    unresolved[k] = v
-                    continue
-        context[k] = v
-    if unresolved:
-        context.update(interpolated(unresolved, context))
-    return context
+    return DependencyGraph(d).resolve(context)
 
 def resolve(iterables, defaults=None, overrides=None, iterator=None):
     """
@@ -74,16 +340,311 @@ def resolve(iterables, defaults=None, overrides=None, iterator=None):
     result.update(overrides)
     return result
 
-def resolve_files(files, defaults=None, overrides=None, iterator=None):
-    """Create a a dictionary from one or more 'property' or 'env' files and
-    interpolate the resulting values.
+def iresolve(iterables, defaults=None, overrides=None, iterator=None):
+    """Streaming version of `resolve`: a generator of resolved key/value
+    pairs, each yielded as soon as the values of all the keys it refers to
+    are known, rather than once the whole input has been read.
+
+    Values still waiting on a reference are held until it is defined, so
+    memory is one dictionary of resolved values plus the unresolved frontier,
+    with no intermediate copies of the input. A MissingReferenceError or
+    CircularReferenceError is raised once the input is exhausted if any key
+    is left unresolved.
+
+    Unlike `resolve`, a value is resolved against the definitions seen so far,
+    and a key which is defined again is yielded again with its new value
+    (later pairs take precedence) without re-yielding keys which had already
+    been resolved against the old value.
+    """
+    if overrides is None:
+        overrides = {}
+    iterator = iterator or iter_properties
+    resolved = {}
+    # key -> [value, segments, names still unresolved]
+    pending = {}
+    # name -> keys waiting for it
+    waiting = {}
+    stream = chain(*[iterator(item) for item in iterables])
+    if defaults:
+        stream = chain(list(defaults.items()), stream)
+    for key, value in stream:
+        segments = compile_template(value)
+        names = set(n for n in _names(segments) if n not in resolved)
+        if names:
+            pending[key] = entry = [value, segments, names]
+            for name in names:
+                waiting.setdefault(name, []).append((key, entry))
+            continue
+        pending.pop(key, None)
+        if segments is not None:
+            value = substitute(segments, resolved)
+        ready = [(key, value)]
+        while ready:
+            key, value = ready.pop()
+            resolved[key] = value
+            yield key, overrides.get(key, value)
+            for k, entry in waiting.pop(key, ()):
+                if pending.get(k) is not entry:
+                    # since redefined
+                    continue
+                names = entry[2]
+                names.discard(key)
+                if not names:
+                    del pending[k]
+                    ready.append((k, substitute(entry[1], resolved)))
+    if pending:
+        # raises the appropriate error with the full path
+        graph = DependencyGraph(dict((k, e[0]) for k, e in pending.items()))
+        graph.order(context=resolved)
+    for key, value in overrides.items():
+        if key not in resolved:
+            yield key, value
+
+def iresolve_files(files, defaults=None, overrides=None, iterator=None):
+    """Streaming version of `resolve_files`, see `iresolve`. Files are
+    read one line at a time, in order, and closed once the generator is
+    exhausted or closed.
     """
     with ExitStack() as stack:
         iterables = []
-        for f in files:
+        for f in expand_files(files):
             if isinstance(f, basestring):
                 iterables.append(stack.enter_context(open(f)))
             else:
                 iterables.append(stack.enter_context(f))
-        return resolve(iterables, defaults, overrides, iterator)
+        for item in iresolve(iterables, defaults, overrides, iterator):
+            yield item
+
+def expand_files(files):
+    """Expand any directories and glob patterns within a list of files.
+
+    A directory is replaced by the regular files within it, and a pattern
+    (eg. 'conf.d/*.properties') by the files which match it, in both cases
+    sorted by name, so that later files take precedence deterministically.
+    Hidden files within directories are ignored. Other items, including file
+    objects, are returned as is.
+    """
+    expanded = []
+    for f in files:
+        if not isinstance(f, basestring):
+            expanded.append(f)
+        elif os.path.isdir(f):
+            for name in sorted(os.listdir(f)):
+                path = os.path.join(f, name)
+                if not name.startswith('.') and os.path.isfile(path):
+                    expanded.append(path)
+        elif _GLOB_MAGIC.search(f) and not os.path.exists(f):
+            import glob
+            matches = sorted(p for p in glob.glob(f) if os.path.isfile(p))
+            if not matches:
+                import warnings
+                warnings.warn("not reading %s - no files match." % f)
+            expanded.extend(matches)
+        else:
+            expanded.append(f)
+    return expanded
+
+def _readlines(path):
+    with open(path) as f:
+        return f.readlines()
+
+def _read(path):
+    with open(path) as f:
+        return f.read()
+
+def read_files(paths, threads=None, reader=None):
+    """Return a list of the result of calling `reader` (default: return the
+    lines of a file) for each file in `paths`.
+
+    By default the files are read in turn, unless there are at least
+    READ_CONCURRENTLY of them, when they are read concurrently by up to
+    READ_THREADS threads. Given `threads`, up to that many are used however
+    few files there are, which pays off when they are on network storage.
+    """
+    reader = reader or _readlines
+    if threads is None:
+        threads = READ_THREADS if len(paths) >= READ_CONCURRENTLY else 1
+    threads = min(threads, len(paths))
+    if threads < 2:
+        return [reader(path) for path in paths]
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(threads)
+    try:
+        return pool.map(reader, paths)
+    finally:
+        pool.terminate()
+
+def parse_file(path, iterator=None, processes=None):
+    """Return the list of key/value pairs in the file at `path`, read as
+    `resolve_files` reads it, but not interpolated.
+    """
+    iterator = iterator or iter_properties
+    if processes is not None and iterator is iter_properties:
+        return scan_properties(path, processes=processes)
+    from .dotenv import iter_dotenv
+    if iterator is iter_dotenv:
+        return list(iterator(_read(path)))
+    if iterator is iter_properties:
+        return list(iterator(_readlines(path)))
+    with open(path) as f:
+        return list(iterator(f))
+
+def resolve_files(
+    files, defaults=None, overrides=None, iterator=None, cache_dir=None,
+    threads=None, processes=None):
+    """Create a a dictionary from one or more 'property' or 'env' files and
+    interpolate the resulting values.
+
+    Directories and glob patterns are expanded (see `expand_files`) and the
+    files are read, concurrently if there are many (see `read_files`), before
+    being merged and interpolated once. An `iterator` other than
+    `iter_properties` or `iter_dotenv` is given each file open, as a file
+    object.
+
+    If `cache_dir` is given, and every file is given as a path, the result is
+    also saved there as a snapshot which later calls load in a single read
+    instead of parsing the files again, as long as none of the files has
+    changed (by size, modification time or inode).
+
+    If `processes` is given, property files are scanned by `scan_properties`
+    with that many processes, which only pays off for files of many
+    megabytes; otherwise they are read line by line, which is faster for
+    most files.
+    """
+    files = expand_files(files)
+    snapshot = None
+    if cache_dir is not None and all(isinstance(f, basestring) for f in files):
+        snapshot = Snapshot(cache_dir, files, defaults, overrides, iterator)
+        try:
+            return snapshot.load()
+        except LookupError:
+            pass
+    from .dotenv import iter_dotenv
+    iterator = iterator or iter_properties
+    # property files given by path may be scanned straight into key/value
+    # pairs
+    scan = processes is not None and iterator is iter_properties
+    if scan:
+        def reader(path):
+            return scan_properties(path, processes=processes)
+    else:
+        reader = _read if iterator is iter_dotenv else None
+    paths = []
+    if iterator is iter_properties or iterator is iter_dotenv:
+        paths = [f for f in files if isinstance(f, basestring)]
+    # other iterators are given open files, as they always have been
+    contents = dict(zip(paths, read_files(paths, threads, reader)))
+    with ExitStack() as stack:
+        iterables = []
+        for f in files:
+            if isinstance(f, basestring) and f in contents:
+                f = contents[f]
+                if not scan:
+                    f = iterator(f)
+            else:
+                if isinstance(f, basestring):
+                    f = open(f)
+                f = iterator(stack.enter_context(f))
+            iterables.append(f)
+        result = resolve(iterables, defaults, overrides, iter)
+    if snapshot is not None:
+        snapshot.save(result)
+    return result
+
+def _iterator_key(iterator):
+    # the same for `iterator` in every process, or None
+    from .dotenv import iter_dotenv
+    if iterator is None or iterator is iter_properties:
+        return 'iter_properties'
+    if iterator is iter_dotenv:
+        return 'iter_dotenv'
+    code = getattr(iterator, '__code__', None)
+    if (code is None or getattr(iterator, '__self__', None) is not None or
+            getattr(iterator, '__closure__', None)):
+        return None
+    # lambdas and nested functions share names, so their code is part of it
+    return (
+        getattr(iterator, '__module__', None),
+        getattr(iterator, '__qualname__', getattr(iterator, '__name__', None)),
+        code.co_filename, code.co_firstlineno, code.co_code,
+        getattr(iterator, '__defaults__', None),
+    )
+
+
+class Snapshot(object):
+    """A pickled `resolve_files` result for a given list of files, defaults,
+    overrides and iterator, stored in `cache_dir`.
+
+    The snapshot is keyed on the arguments and the version of musette, and
+    records the size, modification time and inode of each file when it was
+    saved; it is stale as soon as any of those change, and is then
+    overwritten by the next `save`. Saving is atomic, so concurrent processes
+    can share a cache directory.
+
+    An iterator other than a plain function (eg. a `functools.partial`, a
+    bound method or a closure) can't be identified between processes, so
+    nothing is cached for it.
+    """
+
+    def __init__(self, cache_dir, files, defaults=None, overrides=None,
+            iterator=None):
+        from . import __version__
+        self.files = [os.path.abspath(f) for f in files]
+        self.path = self.fingerprint = None
+        iterator = _iterator_key(iterator)
+        if iterator is None:
+            return
+        key = repr((
+            __version__,
+            self.files,
+            sorted((defaults or {}).items()),
+            sorted((overrides or {}).items()),
+            iterator,
+        ))
+        import hashlib
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        self.path = os.path.join(cache_dir, digest + '.snapshot')
+        # stat before the files are read, so that any later change is seen
+        self.fingerprint = self._fingerprint()
+
+    def _fingerprint(self):
+        fingerprint = []
+        for f in self.files:
+            try:
+                st = os.stat(f)
+            except OSError:
+                return None
+            mtime = getattr(st, 'st_mtime_ns', st.st_mtime)
+            fingerprint.append((st.st_size, mtime, st.st_ino))
+        return fingerprint
+
+    def load(self):
+        """Return the saved dictionary, or raise LookupError if there is no
+        valid snapshot.
+        """
+        if self.fingerprint is None:
+            raise LookupError(self.path)
+        from .compat import pickle
+        try:
+            with open(self.path, 'rb') as f:
+                fingerprint, result = pickle.load(f)
+        except Exception:
+            # missing, unreadable or corrupt
+            raise LookupError(self.path)
+        if fingerprint != self.fingerprint:
+            raise LookupError(self.path)
+        return result
 
+    def save(self, result):
+        """Atomically write `result`. Failure to write is logged, not raised.
+        """
+        if self.fingerprint is None:
+            return
+        from .compat import atomic_write, pickle
+        try:
+            atomic_write(self.path, pickle.dumps(
+                (self.fingerprint, result), pickle.HIGHEST_PROTOCOL
+            ))
+        except Exception as e:
+            import logging
+            logging.getLogger(__file__).warning("not saving snapshot %s: %s", self.path, e)
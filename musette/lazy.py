@@ -0,0 +1,133 @@
+"""
+Lazily evaluated settings.
+"""
+import os
+import copy
+import operator
+
+_EMPTY = object()
+
+def _proxy(func):
+    def inner(self, *args):
+        return func(self._evaluate(), *args)
+    return inner
+
+def _reflected(func):
+    def inner(self, other):
+        return func(other, self._evaluate())
+    return inner
+
+
+class LazyValue(object):
+    """A proxy for the result of calling `func`, which is only called when
+    the proxy is first used, and at most once.
+
+    The proxy forwards attribute access, comparisons, arithmetic and the
+    sequence, mapping and conversion protocols, and reports the class of the
+    result as its own, so that it can stand in for a string, number, list
+    or dict in eg. a Django settings module.
+    """
+    __slots__ = ('_func', '_value')
+
+    def __init__(self, func):
+        object.__setattr__(self, '_func', func)
+        object.__setattr__(self, '_value', _EMPTY)
+
+    def _evaluate(self):
+        value = self._value
+        if value is _EMPTY:
+            value = self._func()
+            object.__setattr__(self, '_value', value)
+            object.__setattr__(self, '_func', None)
+        return value
+
+    def __getattr__(self, name):
+        return getattr(self._evaluate(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._evaluate(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self._evaluate(), name)
+
+    __class__ = property(_proxy(operator.attrgetter('__class__')))
+    __doc__ = property(_proxy(operator.attrgetter('__doc__')))
+
+    __str__ = _proxy(str)
+    __repr__ = _proxy(repr)
+    __format__ = _proxy(format)
+    __dir__ = _proxy(dir)
+    __hash__ = _proxy(hash)
+    __bool__ = _proxy(bool)
+    __nonzero__ = __bool__
+    __int__ = _proxy(int)
+    __float__ = _proxy(float)
+    __index__ = _proxy(operator.index)
+    __call__ = _proxy(lambda value, *args: value(*args))
+    if hasattr(os, 'fspath'):
+        __fspath__ = _proxy(os.fspath)
+
+    __eq__ = _proxy(operator.eq)
+    __ne__ = _proxy(operator.ne)
+    __lt__ = _proxy(operator.lt)
+    __le__ = _proxy(operator.le)
+    __gt__ = _proxy(operator.gt)
+    __ge__ = _proxy(operator.ge)
+
+    __neg__ = _proxy(operator.neg)
+    __pos__ = _proxy(operator.pos)
+    __abs__ = _proxy(abs)
+    __add__ = _proxy(operator.add)
+    __radd__ = _reflected(operator.add)
+    __sub__ = _proxy(operator.sub)
+    __rsub__ = _reflected(operator.sub)
+    __mul__ = _proxy(operator.mul)
+    __rmul__ = _reflected(operator.mul)
+    __truediv__ = _proxy(operator.truediv)
+    __rtruediv__ = _reflected(operator.truediv)
+    __floordiv__ = _proxy(operator.floordiv)
+    __rfloordiv__ = _reflected(operator.floordiv)
+    __mod__ = _proxy(operator.mod)
+    __rmod__ = _reflected(operator.mod)
+
+    __len__ = _proxy(len)
+    __iter__ = _proxy(iter)
+    __reversed__ = _proxy(reversed)
+    __contains__ = _proxy(operator.contains)
+    __getitem__ = _proxy(operator.getitem)
+    __setitem__ = _proxy(operator.setitem)
+    __delitem__ = _proxy(operator.delitem)
+
+    def __copy__(self):
+        return copy.copy(self._evaluate())
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self._evaluate(), memo)
+
+    def __reduce_ex__(self, protocol):
+        return (copy.copy, (self._evaluate(),))
+
+
+class LazyEnvironment(object):
+    """Lazy versions of the methods of an `Environment`: `env.lazy.db()` is
+    a `LazyValue` for the result of `env.db()`, and `env.lazy('VAR', ...)`
+    one for `env('VAR', ...)`.
+    """
+
+    def __init__(self, env):
+        self._env = env
+
+    def __call__(self, *args, **kwargs):
+        env = self._env
+        return LazyValue(lambda: env(*args, **kwargs))
+
+    def __getattr__(self, name):
+        # only methods, as any other attribute is an environment variable
+        if name[:1] == '_' or not callable(getattr(type(self._env), name, None)):
+            raise AttributeError(name)
+        method = getattr(self._env, name)
+        def lazy(*args, **kwargs):
+            return LazyValue(lambda: method(*args, **kwargs))
+        lazy.__name__ = str(name)
+        lazy.__doc__ = method.__doc__
+        return lazy
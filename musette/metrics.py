@@ -0,0 +1,273 @@
+"""
+Metrics of the use of an `Environment`: lookups of each key, the time spent
+parsing values, interpolating, parsing URLs and loading files, and the hit
+rates of the value and URL config caches.
+
+Usage:::
+
+    metrics = env.set_metrics()
+    ...
+    metrics.asdict()
+    print(metrics.prometheus())
+
+An environment is instrumented by replacing some of its methods with timed
+versions on the instance, so an environment without metrics runs the same
+code, at the same speed, as if this module didn't exist.
+"""
+from __future__ import unicode_literals
+
+import time
+import threading
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+URL_CONFIGS = (
+    'db_url_config', 'cache_url_config', 'email_url_config', 'search_url_config'
+)
+
+# the methods replaced on an instrumented instance
+_METHODS = (
+    '_get_value', 'extract', 'interpolate', '_caster', '_spawn', 'read',
+    '_resolve_files', '_load',
+) + URL_CONFIGS
+
+
+class Metrics(object):
+    """Collects the metrics of any number of environments.
+
+    Anything with the `access`, `observe` and `cache` methods can be given
+    to `Environment.set_metrics` instead, eg. to forward the metrics to an
+    existing client. If it also has a `loaded` method, that is called with
+    the values loaded by each `read` (see `musette.trace`); and a
+    `timed(func, operation)` method, if any, is used instead of `_timed` to
+    wrap each function which is timed (see `musette.profiling`).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # key: lookups
+            self.accesses = {}
+            # operation: [calls, seconds, max seconds]
+            self.timings = {}
+            # cache: [hits, misses]
+            self.caches = {}
+
+    def access(self, key, cast=None):
+        """Count a lookup of `key` (as `cast`)."""
+        with self._lock:
+            self.accesses[key] = self.accesses.get(key, 0) + 1
+
+    def observe(self, operation, seconds):
+        """Record a call of `operation` which took `seconds`."""
+        with self._lock:
+            timing = self.timings.get(operation)
+            if timing is None:
+                self.timings[operation] = [1, seconds, seconds]
+            else:
+                timing[0] += 1
+                timing[1] += seconds
+                if seconds > timing[2]:
+                    timing[2] = seconds
+
+    def cache(self, name, hit):
+        """Count a hit, or a miss, of the cache `name`."""
+        with self._lock:
+            counts = self.caches.get(name)
+            if counts is None:
+                counts = self.caches[name] = [0, 0]
+            counts[0 if hit else 1] += 1
+
+    def asdict(self):
+        with self._lock:
+            timings = dict(
+                (operation, dict(calls=calls, seconds=seconds, max=max_))
+                for operation, (calls, seconds, max_) in self.timings.items()
+            )
+            caches = dict(
+                (name, dict(
+                    hits=hits, misses=misses,
+                    hit_rate=float(hits) / (hits + misses) if hits + misses else 0.0,
+                ))
+                for name, (hits, misses) in self.caches.items()
+            )
+            return dict(
+                accesses=dict(self.accesses), timings=timings, caches=caches
+            )
+
+    def prometheus(self, prefix='musette'):
+        """Return the metrics in the Prometheus text exposition format."""
+        d = self.asdict()
+        lines = []
+
+        def metric(name, kind, help, label, values):
+            name = prefix + '_' + name
+            lines.append('# HELP {0} {1}'.format(name, help))
+            lines.append('# TYPE {0} {1}'.format(name, kind))
+            for key in sorted(values):
+                lines.append('{0}{{{1}="{2}"}} {3}'.format(
+                    name, label, _escape(key), _number(values[key])
+                ))
+
+        metric(
+            'accesses_total', 'counter', 'Lookups of each key.', 'key',
+            d['accesses']
+        )
+        timings = d['timings']
+        name = prefix + '_operation_seconds'
+        lines.append('# HELP {0} Time spent in each operation.'.format(name))
+        lines.append('# TYPE {0} summary'.format(name))
+        for operation in sorted(timings):
+            label = '{{operation="{0}"}}'.format(_escape(operation))
+            lines.append('{0}_sum{1} {2}'.format(
+                name, label, _number(timings[operation]['seconds'])
+            ))
+            lines.append('{0}_count{1} {2}'.format(
+                name, label, timings[operation]['calls']
+            ))
+        caches = d['caches']
+        metric(
+            'cache_hits_total', 'counter', 'Hits of each cache.', 'cache',
+            dict((k, v['hits']) for k, v in caches.items())
+        )
+        metric(
+            'cache_misses_total', 'counter', 'Misses of each cache.', 'cache',
+            dict((k, v['misses']) for k, v in caches.items())
+        )
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _number(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _timed(metrics, func, operation):
+    # `func`, observing the time of each call as `operation`
+    def wrapper(*args, **kwargs):
+        start = _timer()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            metrics.observe(operation, _timer() - start)
+    return wrapper
+
+
+def instrument(env, metrics):
+    """Record the metrics of `env` in `metrics`."""
+    uninstrument(env)
+    d = env.__dict__
+    # the methods of the class, bound to `env`
+    methods = dict((name, getattr(env, name)) for name in _METHODS)
+    local = threading.local()
+    timer = getattr(metrics, 'timed', None)
+
+    def timed(func, operation):
+        if timer is not None:
+            return timer(func, operation)
+        return _timed(metrics, func, operation)
+
+    def timed_parse(parse):
+        return None if parse is None else timed(parse, 'parse_value')
+
+    def _get_value(var, cast=None, default=env.NOTSET):
+        metrics.access(var, cast)
+        cache = env._cache
+        if cache is not None:
+            if env._threadsafe:
+                snapshot = env._snapshot
+                cache = None if snapshot is None else snapshot.cache
+            key = cast, type(default), default
+            try:
+                hash(key)
+            except TypeError:
+                # unhashable, so not cached
+                pass
+            else:
+                metrics.cache(
+                    'values', cache is not None and key in cache.get(var, ())
+                )
+        return get_value(var, cast, default)
+
+    def extract(schema):
+        for var, cast in schema.items():
+            if isinstance(cast, tuple):
+                cast = cast[0]
+            metrics.access(var, cast)
+        return methods['extract'](schema)
+
+    def _caster(cast):
+        # casts compiled within a cast (eg. dict values) aren't timed, as
+        # they're part of the outer cast, and may be memoized with it
+        if getattr(local, 'compiling', False):
+            return methods['_caster'](cast)
+        local.compiling = True
+        try:
+            return timed_parse(methods['_caster'](cast))
+        finally:
+            local.compiling = False
+
+    def _spawn(init):
+        # copies get the original accessors, which aren't timed
+        spawned = env.__class__.__new__(env.__class__)
+        spawned._setup(init, env._schema, accessors, env._casts)
+        return spawned
+
+    def read(files, defaults=None, overrides=None, iterator=None, *args, **kwargs):
+        from .dotenv import iter_dotenv
+        operation = 'read_env' if iterator is iter_dotenv else 'read'
+        return timed(methods['read'], operation)(
+            files, defaults, overrides, iterator, *args, **kwargs
+        )
+
+    def _load(values, *args, **kwargs):
+        metrics.loaded(values)
+        return methods['_load'](values, *args, **kwargs)
+
+    def url_config(name):
+        method = timed(methods[name], name)
+        def wrapper(*args, **kwargs):
+            cache = env.URL_CONFIG_CACHE
+            hits = None if cache is None else cache.hits
+            try:
+                return method(*args, **kwargs)
+            finally:
+                if hits is not None:
+                    metrics.cache('url_config', cache.hits > hits)
+        return wrapper
+
+    get_value = timed(methods['_get_value'], 'get_value')
+    accessors = env._accessors
+    d['_instrumented'] = accessors
+    d['_accessors'] = dict(
+        (var, (timed_parse(parse), default))
+        for var, (parse, default) in accessors.items()
+    )
+    d['_get_value'] = _get_value
+    d['extract'] = timed(extract, 'extract')
+    d['interpolate'] = timed(methods['interpolate'], 'interpolate')
+    d['_caster'] = _caster
+    d['_spawn'] = _spawn
+    d['read'] = read
+    d['_resolve_files'] = timed(methods['_resolve_files'], 'resolve_files')
+    if hasattr(metrics, 'loaded'):
+        d['_load'] = _load
+    for name in URL_CONFIGS:
+        d[name] = url_config(name)
+    d['_metrics'] = metrics
+
+
+def uninstrument(env):
+    """Stop recording the metrics of `env`."""
+    d = env.__dict__
+    if d.get('_metrics') is None:
+        return
+    for name in _METHODS:
+        d.pop(name, None)
+    d['_accessors'] = d.pop('_instrumented')
+    d['_metrics'] = None
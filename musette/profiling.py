@@ -0,0 +1,246 @@
+"""
+Profiling of the configuration loading of a settings module or script, as
+run by ``python -m musette profile``.
+
+Every `Environment` is instrumented with a `Profiler`, which records the
+time and the bytes allocated in each operation (`read`, `read_env`,
+`resolve_files`, `interpolate`, `parse_value`, the URL config parsers and
+so on), the time of the lookups of each key, and the stack of operations,
+below the Python functions which called them, for flame graphs.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import sys
+import threading
+
+from .metrics import Metrics, _timer
+from .trace import _INTERNAL
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# the modules which run the target, whose frames aren't part of its stacks
+_RUNNERS = frozenset([
+    'runpy', 'importlib', 'importlib._bootstrap',
+    'importlib._bootstrap_external',
+])
+
+
+def _traced():
+    # the bytes currently allocated, if tracemalloc is tracing
+    if tracemalloc is None or not tracemalloc.is_tracing():
+        return 0
+    return tracemalloc.get_traced_memory()[0]
+
+
+def _label(text):
+    # a frame of a collapsed stack can't contain ';'
+    return text.replace(';', ',')
+
+
+def _caller_stack(root=None):
+    # the frames which called into musette, outermost first, up to `root`
+    frames = []
+    frame = sys._getframe(2)
+    while frame is not None and frame is not root:
+        name = frame.f_globals.get('__name__')
+        if name not in _INTERNAL and name not in _RUNNERS:
+            code = frame.f_code
+            frames.append(_label('{0} ({1}:{2})'.format(
+                code.co_name, os.path.basename(code.co_filename),
+                code.co_firstlineno,
+            )))
+        frame = frame.f_back
+    frames.reverse()
+    return tuple(frames)
+
+
+def _format_time(seconds):
+    if seconds >= 1:
+        return '{0:.2f} s'.format(seconds)
+    if seconds >= 1e-3:
+        return '{0:.2f} ms'.format(seconds * 1e3)
+    return '{0:.1f} us'.format(seconds * 1e6)
+
+
+def _format_size(size):
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(size) < 1024:
+            return '{0:.0f} {1}'.format(size, unit)
+        size /= 1024.0
+    return '{0:.1f} GiB'.format(size)
+
+
+class Profiler(Metrics):
+    """Metrics which also record the self time and the bytes allocated
+    (while tracemalloc is tracing) of each operation, the time of the
+    lookups of each key and the stacks of operations.
+    """
+
+    def reset(self):
+        super(Profiler, self).reset()
+        with self._lock:
+            # operation: [self seconds, bytes allocated]
+            self.costs = {}
+            # key: [lookups, seconds]
+            self.keys = {}
+            # collapsed stack: self seconds
+            self.stacks = {}
+        self._local = threading.local()
+
+    # the frame below which stacks start (see `run`)
+    root = None
+
+    def access(self, key, cast=None):
+        super(Profiler, self).access(key, cast)
+        self._local.key = key
+
+    def timed(self, func, operation):
+        """Wrap `func`, recording each call of it as `operation`."""
+        def wrapper(*args, **kwargs):
+            local = self._local
+            stack = getattr(local, 'stack', None)
+            if stack is None:
+                stack = local.stack = []
+            key = None
+            label = operation
+            if operation == 'get_value':
+                key = getattr(local, 'key', None)
+                label = _label('get_value({0})'.format(key))
+            if stack:
+                path = stack[-1][0] + (label,)
+            else:
+                path = _caller_stack(self.root) + (label,)
+            # [path, time in nested operations]
+            frame = [path, 0.0]
+            stack.append(frame)
+            memory = _traced()
+            start = _timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = _timer() - start
+                allocated = _traced() - memory
+                stack.pop()
+                if stack:
+                    stack[-1][1] += elapsed
+                self._record(
+                    operation, key, path, elapsed, elapsed - frame[1], allocated
+                )
+        return wrapper
+
+    def _record(self, operation, key, path, elapsed, own, allocated):
+        self.observe(operation, elapsed)
+        with self._lock:
+            cost = self.costs.setdefault(operation, [0.0, 0])
+            cost[0] += own
+            cost[1] += allocated
+            if key is not None:
+                lookups = self.keys.setdefault(key, [0, 0.0])
+                lookups[0] += 1
+                lookups[1] += elapsed
+            stack = ';'.join(path)
+            self.stacks[stack] = self.stacks.get(stack, 0.0) + own
+
+    def total(self):
+        """The time spent in musette, ie. in the outermost operations."""
+        with self._lock:
+            return sum(self.stacks.values())
+
+    def write_collapsed(self, stream):
+        """Write the stacks in the collapsed format of flamegraph.pl and
+        compatible tools, weighted by microseconds of self time.
+        """
+        with self._lock:
+            stacks = sorted(self.stacks.items())
+        for stack, seconds in stacks:
+            count = int(round(seconds * 1e6))
+            if count:
+                stream.write('{0} {1}\n'.format(stack, count))
+
+    def print_report(self, stream=None, top=10):
+        """Print the time and allocations of each operation, and the `top`
+        slowest keys.
+        """
+        stream = stream or sys.stdout
+        d = self.asdict()
+        with self._lock:
+            costs = dict(self.costs)
+            keys = sorted(self.keys.items(), key=lambda kv: -kv[1][1])[:top]
+        row = '{0:<20} {1:>7} {2:>10} {3:>10} {4:>10} {5:>10}'
+        print(row.format(
+            'operation', 'calls', 'total', 'self', 'max', 'allocated'
+        ), file=stream)
+        timings = d['timings']
+        for operation in sorted(
+                timings, key=lambda op: -timings[op]['seconds']):
+            timing = timings[operation]
+            own, allocated = costs.get(operation, (0.0, 0))
+            print(row.format(
+                operation, timing['calls'], _format_time(timing['seconds']),
+                _format_time(own), _format_time(timing['max']),
+                _format_size(allocated),
+            ), file=stream)
+        if keys:
+            print('', file=stream)
+            row = '{0:<40} {1:>7} {2:>10}'
+            print(row.format('slowest keys', 'lookups', 'total'), file=stream)
+            for key, (lookups, seconds) in keys:
+                print(row.format(key, lookups, _format_time(seconds)), file=stream)
+        caches = d['caches']
+        if caches:
+            print('', file=stream)
+            for name in sorted(caches):
+                cache = caches[name]
+                print('{0} cache: {1} hits, {2} misses'.format(
+                    name, cache['hits'], cache['misses']
+                ), file=stream)
+
+
+def run(target, module=False, argv=(), allocations=True):
+    """Import the module, or run the script, `target` with every
+    `Environment` instrumented by a new `Profiler`, and return the profiler
+    and the time taken. A script is run as __main__, with `argv`.
+    """
+    import runpy
+    from . import _environ
+    from ._environ import Environment
+    profiler = Profiler()
+    profiler.root = sys._getframe()
+    previous = Environment.METRICS
+    Environment.METRICS = profiler
+    if 'environ' in vars(_environ):
+        # created when musette was imported (Python < 3.7)
+        _environ.environ.set_metrics(profiler)
+    started = False
+    if allocations and tracemalloc is not None and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        started = True
+    saved_argv = sys.argv
+    saved_path = list(sys.path)
+    start = _timer()
+    try:
+        if module:
+            import importlib
+            sys.path.insert(0, os.getcwd())
+            importlib.import_module(target)
+        else:
+            sys.argv = [target] + list(argv)
+            sys.path.insert(0, os.path.dirname(os.path.abspath(target)))
+            runpy.run_path(target, run_name='__main__')
+    except SystemExit:
+        pass
+    finally:
+        elapsed = _timer() - start
+        if started:
+            tracemalloc.stop()
+        sys.argv = saved_argv
+        sys.path[:] = saved_path
+        Environment.METRICS = previous
+        if 'environ' in vars(_environ) and _environ.environ.metrics is profiler:
+            _environ.environ.set_metrics(None)
+    return profiler, elapsed
@@ -0,0 +1,74 @@
+"""
+Parsing of 'property' files, with a reader which splits large files between
+processes.
+"""
+import os
+from itertools import chain
+
+def iter_properties(iterable):
+    """Split lines on '=' and ':=' ignoring blank lines and comments.
+    """
+    for line in iterable:
+        if not line.isspace() and not line.startswith('#'):
+            key, sep, val = line.partition(':=')
+            if not sep:
+                key, sep, val = line.partition('=')
+            if not key.isspace() and sep:
+                yield key.strip(), val.strip()
+
+def _scan(path, start=0, end=None, encoding='utf-8'):
+    # the key/value pairs within a byte range of a file
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read() if end is None else f.read(end - start)
+    return list(iter_properties(data.decode(encoding).split('\n')))
+
+def _scan_chunk(args):
+    return _scan(*args)
+
+def chunks(path, count):
+    """Split a file into (at most) `count` (start, end) byte ranges of
+    roughly equal size, each ending on a line boundary.
+    """
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, count):
+            # the end of the line at (or after) the even split
+            f.seek(max(size * i // count, bounds[-1]))
+            f.readline()
+            pos = f.tell()
+            if pos >= size:
+                break
+            bounds.append(pos)
+    bounds.append(size)
+    return [(s, e) for s, e in zip(bounds, bounds[1:]) if e > s]
+
+def scan_properties(path, encoding=None, processes=None):
+    """Return a list of the key/value pairs of a property file, in order.
+
+    The file is read and decoded in a single call (using the locale's
+    preferred encoding if `encoding` isn't given, as `open` does), then split
+    into lines parsed as by `iter_properties`.
+
+    If `processes` is more than 1, the file is split into byte ranges at line
+    boundaries which are read and parsed in parallel by a process pool, which
+    is only worthwhile for files of many megabytes.
+    """
+    if encoding is None:
+        import locale
+        encoding = locale.getpreferredencoding(False)
+    if not processes or processes < 2:
+        return _scan(path, encoding=encoding)
+    ranges = chunks(path, processes)
+    if len(ranges) < 2:
+        return _scan(path, encoding=encoding)
+    from multiprocessing import Pool
+    pool = Pool(min(processes, len(ranges)))
+    try:
+        results = pool.map(
+            _scan_chunk, [(path, s, e, encoding) for s, e in ranges]
+        )
+    finally:
+        pool.terminate()
+    return list(chain(*results))
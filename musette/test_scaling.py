@@ -0,0 +1,232 @@
+"""
+Scaling tests: time and memory of the main operations on synthetic configs
+of 10^2 to 10^5 keys, which fail if either grows faster than expected.
+
+The growth exponent k in t ~ n^k is fitted over the sizes of each test, and
+compared with that of the expected complexity class, plus a tolerance for
+the noise of timing on a shared machine. A linear operation which turns
+quadratic has an exponent near 2, well clear of the tolerance.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import gc
+import os
+import math
+import shutil
+import tempfile
+import unittest
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from musette._environ import Environment
+from musette.interpolation import interpolated, resolve, resolve_files
+from musette.bench import timeit
+
+LINEAR = 1.0
+# n log n, from 10^2 to 10^5, fits an exponent of about 1.1
+TOLERANCE = 0.45
+MEMORY_TOLERANCE = 0.2
+
+
+def synthetic(n, depth=1, fanout=1):
+    """Return a config of `n` keys in trees of references: each tree has a
+    root with a literal value and `depth` levels below it, each key of which
+    refers to its parent, which has `fanout` children. So depth=0 is `n`
+    literal values, fanout=1 is chains of `depth` + 1 keys, and depth=1 is
+    stars of `fanout` keys around a root.
+    """
+    d = {}
+    i = 0
+    while i < n:
+        root = 'KEY_%d' % i
+        d[root] = 'root'
+        i += 1
+        level = [root]
+        for _ in range(depth):
+            children = []
+            for parent in level:
+                for _ in range(fanout):
+                    if i >= n:
+                        break
+                    key = 'KEY_%d' % i
+                    d[key] = '${%s}/x' % parent
+                    children.append(key)
+                    i += 1
+            level = children
+            if not level:
+                break
+    return d
+
+
+def exponent(sizes, measurements):
+    """The least squares slope of log(measurement) over log(size)."""
+    xs = [math.log(n) for n in sizes]
+    ys = [math.log(m) for m in measurements]
+    mx = sum(xs) / len(xs)
+    my = sum(ys) / len(ys)
+    return (
+        sum((x - mx) * (y - my) for x, y in zip(xs, ys)) /
+        sum((x - mx) ** 2 for x in xs)
+    )
+
+
+def measure_time(func):
+    # best time per call, without the garbage collector, as timeit does
+    enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        return timeit(func, min_time=0.02, repeat=2)[0]
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def measure_memory(func):
+    # peak bytes allocated during a call
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class ScalingTests(unittest.TestCase):
+
+    SIZES = [10 ** 2, 10 ** 3, 10 ** 4]
+    # for one case of each operation, as it takes a while
+    LARGE = SIZES + [10 ** 5]
+    SHAPES = [
+        # (depth, fanout)
+        (0, 1), (1, 1), (10, 1), (100, 1), (2, 10), (1, 1000),
+    ]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def assertScales(self, name, setup, sizes=None, complexity=LINEAR):
+        """Check that the time and memory of the function returned by
+        `setup(n)` grow no faster than n ** `complexity`. Memory, which
+        doesn't vary between runs, is only measured for the smaller sizes.
+        """
+        sizes = sizes or self.SIZES
+        funcs = []
+        times = []
+        for n in sizes:
+            funcs.append(setup(n))
+            times.append(measure_time(funcs[-1]))
+            if len(times) < 2:
+                continue
+            # checked as it goes, so a regression fails before the largest
+            # sizes, which could then take very long
+            k = exponent(sizes[:len(times)], times)
+            self.assertTrue(
+                k <= complexity + TOLERANCE,
+                "{0}: time grows as n^{1:.2f} (expected n^{2}): {3}".format(
+                    name, k, complexity, self._table(sizes, times, 's')
+                )
+            )
+        if tracemalloc is None:
+            return
+        sizes = [n for n in sizes if n <= self.SIZES[-1]]
+        memory = [measure_memory(func) for func in funcs[:len(sizes)]]
+        k = exponent(sizes, memory)
+        self.assertTrue(
+            k <= complexity + MEMORY_TOLERANCE,
+            "{0}: memory grows as n^{1:.2f} (expected n^{2}): {3}".format(
+                name, k, complexity, self._table(sizes, memory, 'B')
+            )
+        )
+
+    def _table(self, sizes, measurements, unit):
+        return ', '.join(
+            '{0}: {1:.3g}{2}'.format(n, m, unit) for n, m in zip(sizes, measurements)
+        )
+
+    def write(self, d, name='scaling.properties'):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            for key in sorted(d):
+                f.write('{0} = {1}\n'.format(key, d[key]))
+        return path
+
+    def test_synthetic(self):
+        d = synthetic(10, depth=2, fanout=2)
+        self.assertEqual(len(d), 10)
+        self.assertEqual(d['KEY_0'], 'root')
+        self.assertEqual(d['KEY_2'], '${KEY_0}/x')
+        self.assertEqual(d['KEY_6'], '${KEY_2}/x')
+        self.assertEqual(d['KEY_7'], 'root')
+        values = interpolated(d)
+        self.assertEqual(values['KEY_6'], 'root/x/x')
+        self.assertEqual(values['KEY_9'], 'root/x')
+
+    def test_exponent(self):
+        sizes = [10, 100, 1000]
+        self.assertAlmostEqual(exponent(sizes, [2 * n for n in sizes]), 1.0)
+        self.assertAlmostEqual(exponent(sizes, [n * n for n in sizes]), 2.0)
+
+    def test_resolve(self):
+        for depth, fanout in self.SHAPES:
+            sizes = self.LARGE if (depth, fanout) == (1, 1) else self.SIZES
+            def setup(n, depth=depth, fanout=fanout):
+                lines = ['{0} = {1}'.format(*kv) for kv in synthetic(n, depth, fanout).items()]
+                return lambda: resolve([lines])
+            self.assertScales(
+                'resolve(depth={0}, fanout={1})'.format(depth, fanout),
+                setup, sizes,
+            )
+
+    def test_resolve_files(self):
+        def setup(n):
+            path = self.write(synthetic(n, depth=2, fanout=10), 'files_%d' % n)
+            return lambda: resolve_files([path])
+        self.assertScales('resolve_files', setup, self.LARGE)
+
+    def test_read(self):
+        def setup(n):
+            path = self.write(synthetic(n, depth=10), 'read_%d' % n)
+            return lambda: Environment({}).read(path)
+        self.assertScales('Environment.read', setup)
+
+    def test_bulk_get_value(self):
+        # every key of a new environment, each interpolated on first use
+        for depth, fanout in [(0, 1), (10, 1), (1, 1000)]:
+            def setup(n, depth=depth, fanout=fanout):
+                d = synthetic(n, depth, fanout)
+                keys = sorted(d)
+                def get_all():
+                    env = Environment(dict(d))
+                    for key in keys:
+                        env.get_value(key)
+                return get_all
+            self.assertScales(
+                'get_value(depth={0}, fanout={1})'.format(depth, fanout),
+                setup, self.SIZES if depth else self.LARGE,
+            )
+
+    def test_get_value_after_change(self):
+        # changing one key only interpolates its dependents again, so the
+        # cost of a change and a lookup doesn't grow with the environment
+        def setup(n):
+            env = Environment(synthetic(n, depth=10))
+            for key in env.keys():
+                env.get_value(key)
+            values = ['root', 'changed']
+            def change():
+                values.reverse()
+                env['KEY_0'] = values[0]
+                env.get_value('KEY_10')
+            return change
+        self.assertScales('get_value after a change', setup, complexity=0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+"""
+Tracing of the keys of an `Environment` which are read, as what and from
+where, to find the keys which are loaded but never read, and those which are
+read but missing.
+
+Usage:::
+
+    tracer = env.trace()
+    ...
+    print(tracer.report(env))
+
+or, to print the report to stderr when the process exits::
+
+    env.trace(at_exit=True)
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import sys
+
+from .metrics import Metrics
+
+# the modules whose frames aren't call sites
+_INTERNAL = frozenset([
+    'musette', 'musette._environ', 'musette.metrics', 'musette.trace',
+    'musette.lazy',
+])
+
+
+def _call_site():
+    # (filename, line, function) of the first frame outside musette
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_globals.get('__name__') in _INTERNAL:
+        frame = frame.f_back
+    if frame is None:
+        return None
+    return frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name
+
+
+def _cast_name(cast):
+    name = getattr(cast, '__name__', None)
+    return repr(cast) if name is None else name
+
+
+def _site_name(site):
+    return '{0}:{1} in {2}'.format(*site) if site else '?'
+
+
+class Tracer(Metrics):
+    """Metrics which also record the casts each key is read as, the call
+    sites it is read from, and the keys loaded by `read` and `read_env`.
+    """
+
+    def reset(self):
+        super(Tracer, self).reset()
+        with self._lock:
+            # key: set of cast names
+            self.casts = {}
+            # key: {(filename, line, function): lookups}
+            self.sites = {}
+            self.loaded_keys = set()
+
+    def access(self, key, cast=None):
+        site = _call_site()
+        with self._lock:
+            self.accesses[key] = self.accesses.get(key, 0) + 1
+            self.casts.setdefault(key, set()).add(_cast_name(cast))
+            sites = self.sites.setdefault(key, {})
+            sites[site] = sites.get(site, 0) + 1
+
+    def loaded(self, keys):
+        with self._lock:
+            self.loaded_keys.update(keys)
+
+    def report(self, env):
+        """Return a `TraceReport` of the keys of `env` read so far."""
+        return TraceReport(self, env)
+
+    def report_at_exit(self, env, stream=None):
+        """Print the report for `env` to `stream` (default: stderr) when the
+        process exits.
+        """
+        import atexit
+        def report():
+            print(self.report(env), file=stream or sys.stderr)
+        atexit.register(report)
+
+
+class TraceReport(object):
+    """The keys read from an environment.
+
+    `unread` is the sorted list of the keys loaded, by `read` or, if nothing
+    was read, by creating the environment, but never read. `missing` is the
+    sorted list of the keys read but not in the environment (which may have
+    had defaults). `read` maps each key read to a dict of its `count` of
+    lookups, its `casts` and its call `sites`, most frequent first.
+    """
+
+    def __init__(self, tracer, env):
+        keys = set(env.keys())
+        with tracer._lock:
+            loaded = set(tracer.loaded_keys) or keys
+            self.read = dict(
+                (key, dict(
+                    count=count,
+                    casts=sorted(tracer.casts[key]),
+                    sites=[
+                        _site_name(site) for site, _ in sorted(
+                            tracer.sites[key].items(), key=lambda kv: -kv[1]
+                        )
+                    ],
+                ))
+                for key, count in tracer.accesses.items()
+            )
+        self.unread = sorted(loaded.difference(self.read))
+        self.missing = sorted(key for key in self.read if key not in keys)
+        self.loaded = len(loaded)
+
+    def asdict(self):
+        return dict(unread=self.unread, missing=self.missing, read=self.read)
+
+    def __str__(self):
+        lines = ['Loaded but never read ({0} of {1}):'.format(
+            len(self.unread), self.loaded
+        )]
+        lines.extend('    ' + key for key in self.unread)
+        lines.append('Read but missing ({0}):'.format(len(self.missing)))
+        for key in self.missing:
+            read = self.read[key]
+            lines.append('    {0} ({1})'.format(key, ', '.join(read['casts'])))
+            lines.extend('        ' + site for site in read['sites'])
+        return '\n'.join(lines)
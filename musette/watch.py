@@ -0,0 +1,350 @@
+"""
+Reloading of configuration files when they change.
+"""
+import os
+import sys
+import errno
+import select
+import struct
+import threading
+
+from ._environ import _source_key
+from .interpolation import DependencyGraph, expand_files, parse_file
+
+
+def _fingerprint(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, getattr(st, 'st_mtime_ns', st.st_mtime), st.st_ino
+
+
+class ChangeEvent(object):
+    """Sent to the subscribers of a `Watcher` when a file change has been
+    applied to its environment.
+
+    `keys` is the sorted list of the keys whose values changed, including
+    those in `removed`, the keys which no longer have a value.
+    """
+
+    def __init__(self, env, path, keys, removed=()):
+        self.env = env
+        self.path = path
+        self.keys = keys
+        self.removed = removed
+
+    def __repr__(self):
+        return '<ChangeEvent: {0} {1}>'.format(self.path, self.keys)
+
+
+class _Group(object):
+    # the files of one call to `Environment.read`, with the pairs each one
+    # yielded, the interpolated values and the result (after overrides)
+
+    def __init__(self, files, defaults, overrides, iterator):
+        self.files = [os.path.abspath(f) for f in expand_files(files)]
+        self.defaults = defaults or {}
+        self.overrides = overrides or {}
+        self.iterator = iterator
+        self.pairs = dict((f, parse_file(f, iterator)) for f in self.files)
+        self._set(DependencyGraph(self.raw()).resolve())
+
+    def _set(self, resolved):
+        self.resolved = resolved
+        self.result = dict(resolved)
+        self.result.update(self.overrides)
+
+    def raw(self, path=None, pairs=None):
+        # the merged values, with the pairs of `path` replaced by `pairs`
+        raw = dict(self.defaults)
+        for f in self.files:
+            raw.update(pairs if f == path else self.pairs[f])
+        return raw
+
+    def reload(self, path):
+        """Parse `path` again and return the set of keys whose values may
+        have changed, and the new state of the group, for `apply`. Only the
+        keys whose values changed in the file, and their dependents, are
+        interpolated again. The group itself isn't changed.
+        """
+        pairs = parse_file(path, self.iterator)
+        old = self.raw()
+        new = self.raw(path, pairs)
+        stale = set(k for k in set(old) | set(new) if old.get(k) != new.get(k))
+        resolved = None
+        if stale:
+            graph = DependencyGraph(new)
+            graph.parse()
+            stale.update(graph.dependents(stale))
+            resolved = graph.update(dict(self.resolved), stale)
+        return stale, (path, pairs, resolved)
+
+    def apply(self, state):
+        path, pairs, resolved = state
+        self.pairs[path] = pairs
+        if resolved is not None:
+            self._set(resolved)
+
+
+class _Inotify(object):
+    # the inotify API of the Linux C library, through ctypes
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CLOEXEC = 0o2000000
+    IN_NONBLOCK = 0o4000
+    _EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        try:
+            self._add_watch = libc.inotify_add_watch
+            init = libc.inotify_init1
+        except AttributeError:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        fd = init(self.IN_CLOEXEC | self.IN_NONBLOCK)
+        if fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self._ctypes = ctypes
+        self.fd = fd
+        self._dirs = {}
+
+    def add(self, dirname):
+        # files are watched through their directory, which also sees a file
+        # replaced by a rename, as editors and deployment tools tend to do
+        if dirname in self._dirs.values():
+            return
+        wd = self._add_watch(
+            self.fd, dirname.encode(sys.getfilesystemencoding()),
+            self.IN_CLOSE_WRITE | self.IN_MOVED_TO,
+        )
+        if wd < 0:
+            e = self._ctypes.get_errno()
+            raise OSError(e, os.strerror(e), dirname)
+        self._dirs[wd] = dirname
+
+    def read(self, timeout):
+        """Wait up to `timeout` seconds and return the paths written to."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            buf = os.read(self.fd, 65536)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        paths = []
+        size = self._EVENT.size
+        offset = 0
+        while offset + size <= len(buf):
+            wd, mask, cookie, length = self._EVENT.unpack_from(buf, offset)
+            offset += size
+            name = buf[offset:offset + length].rstrip(b'\0')
+            offset += length
+            dirname = self._dirs.get(wd)
+            if dirname is not None and name:
+                name = name.decode(sys.getfilesystemencoding())
+                paths.append(os.path.join(dirname, name))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher(object):
+    """Reload the files read into an `Environment` (by `read` or `read_env`)
+    when they change.
+
+    Only a changed file is parsed again, and only the keys whose values
+    changed, and the keys which refer to them, are interpolated again. The
+    new values are applied to the environment in a single update, unless
+    they can't be interpolated, in which case the change is logged and
+    ignored. A key removed from every file goes back to the value it had
+    before it was first read, if it had one (eg. in os.environ), rather than
+    being removed. Files read later take precedence, as they do for `read`.
+    Files read after the watcher is created are also watched, and files read
+    again with the same arguments are watched once, in the place of the last
+    read.
+
+    The environment is made thread-safe (see `Environment.set_threadsafe`),
+    so that threads reading it never see part of a reload.
+
+    On Linux the files are watched with inotify, unless `inotify` is False;
+    otherwise they are polled for changes every `interval` seconds. Changes
+    are picked up by a daemon thread once `start` is called, or by calling
+    `check` directly.
+    """
+
+    def __init__(self, env, interval=1.0, inotify=None):
+        env.set_threadsafe()
+        self.env = env
+        self.interval = interval
+        self._groups = []
+        # the source key of each group
+        self._keys = []
+        self._fingerprints = {}
+        self._subscribers = []
+        self._lock = threading.RLock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._inotify = None
+        if inotify or (inotify is None and sys.platform.startswith('linux')):
+            try:
+                self._inotify = _Inotify()
+            except OSError:
+                if inotify:
+                    raise
+        self._track()
+
+    def subscribe(self, callback):
+        """Call `callback` with a `ChangeEvent` after each change."""
+        self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    @property
+    def paths(self):
+        """The files being watched."""
+        paths = []
+        for group in self._groups:
+            paths.extend(f for f in group.files if f not in paths)
+        return paths
+
+    def _track(self):
+        # start watching the files of any new calls to `read`, and keep the
+        # groups in the order of the sources, as a repeated call moves last
+        sources = self.env._sources
+        keys = [_source_key(*source) for source in sources]
+        if keys == self._keys:
+            return
+        groups = dict(zip(self._keys, self._groups))
+        self._groups = []
+        for key, source in zip(keys, sources):
+            group = groups.get(key)
+            if group is None:
+                group = _Group(*source)
+                for f in group.files:
+                    self._fingerprints[f] = _fingerprint(f)
+                    if self._inotify is not None:
+                        self._inotify.add(os.path.dirname(f))
+            self._groups.append(group)
+        self._keys = keys
+
+    def check(self, paths=None):
+        """Reload any of `paths` (default: all the files) which changed since
+        they were last read, and return the list of `ChangeEvent`.
+        """
+        with self._lock:
+            self._track()
+            events = []
+            for path in self.paths if paths is None else paths:
+                fingerprint = _fingerprint(path)
+                if fingerprint is None:
+                    # (re)moved, perhaps about to be replaced
+                    continue
+                if fingerprint != self._fingerprints.get(path, fingerprint):
+                    event = self.reload(path)
+                    if event is not None:
+                        events.append(event)
+            return events
+
+    def reload(self, path):
+        """Parse `path` again, apply any changes to the environment and tell
+        the subscribers. Returns the `ChangeEvent`, or None if nothing
+        changed.
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            self._fingerprints[path] = _fingerprint(path)
+            stale = set()
+            # every group with the file is reloaded before any is changed, so
+            # that a failure leaves them all as they were
+            reloaded = []
+            for group in self._groups:
+                if path in group.files:
+                    try:
+                        keys, state = group.reload(path)
+                    except (IOError, OSError, KeyError, ValueError) as e:
+                        import logging
+                        logging.getLogger(__name__).warning(
+                            "not reloading %s: %s", path, e
+                        )
+                        return None
+                    stale.update(keys)
+                    reloaded.append((group, state))
+            for group, state in reloaded:
+                group.apply(state)
+            # a key takes its value from the last group that has it
+            results = [group.result for group in reversed(self._groups)]
+            with self.env._lock:
+                environ = self.env._environ
+                # the values of keys before any file was read
+                original = self.env._original
+                values = {}
+                removed = []
+                for key in stale:
+                    for result in results:
+                        if key in result:
+                            if environ.get(key) != result[key]:
+                                values[key] = result[key]
+                            break
+                    else:
+                        value = original.get(key, self.env.NOTSET)
+                        if value is not self.env.NOTSET:
+                            if environ.get(key) != value:
+                                values[key] = value
+                        elif key in environ:
+                            removed.append(key)
+                if not values and not removed:
+                    return None
+                self.env._apply(values, removed)
+        event = ChangeEvent(
+            self.env, path, sorted(set(values).union(removed)), sorted(removed)
+        )
+        for callback in list(self._subscribers):
+            callback(event)
+        return event
+
+    def start(self):
+        """Watch for changes in a daemon thread."""
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def close(self):
+        self.stop()
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                if self._inotify is None:
+                    self._stopped.wait(self.interval)
+                    if not self._stopped.is_set():
+                        self.check()
+                    continue
+                written = self._inotify.read(self.interval)
+                with self._lock:
+                    self._track()
+                    for path in self.paths:
+                        if path in written:
+                            self.reload(path)
+            except Exception:
+                import logging
+                logging.getLogger(__name__).exception("reload failed")